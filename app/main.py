@@ -4,13 +4,18 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
 # from townsnet import SERVICE_TYPES, Territory
 # from .utils import REGIONS_DICT, get_provision, get_region, process_output, process_territory
-from .utils import api_client
+from .utils import api_client, http_client, compute, metrics
 from .routers.engineering import engineering_controller
 from .routers.provision import provision_controller
 from .routers.hex import hex_controller
+from .routers.admin import admin_controller
+from .routers.jobs import jobs_controller
+from .routers.health import health_controller
+from .routers.metrics import metrics_controller
 from contextlib import asynccontextmanager
 
-controllers = [provision_controller, engineering_controller, hex_controller]
+# jobs controller goes first so other controllers can submit jobs on startup, health controller goes last to report readiness
+controllers = [jobs_controller, provision_controller, engineering_controller, hex_controller, admin_controller, metrics_controller, health_controller]
 
 async def on_startup():
     for controller in controllers:
@@ -22,9 +27,12 @@ async def on_shutdown():
 
 @asynccontextmanager
 async def lifespan(app : FastAPI):
+    await http_client.open_client()
     await on_startup()
     yield
     await on_shutdown()
+    compute.shutdown()
+    await http_client.close_client()
 
 app = FastAPI(
     title='TownsNet API',
@@ -39,6 +47,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# wrapped by gzip, so payloads are measured before compression
+app.add_middleware(metrics.MetricsMiddleware)
 app.add_middleware(GZipMiddleware, minimum_size=100)
 
 @app.get("/", include_in_schema=False)
@@ -0,0 +1,59 @@
+import asyncio
+from fastapi import APIRouter, Depends
+from loguru import logger
+from ...utils import cache, tiles, compute
+from ...utils.auth import verify_token
+from ..provision import provision_store, provision_service
+from ..engineering import engineering_service
+
+INVALIDATIONS_CHECK_INTERVAL = 10
+
+_invalidations_task : asyncio.Task | None = None
+
+def _invalidate(region_id : int | None = None) -> int:
+    return cache.invalidate_region(region_id) + tiles.invalidate_tiles(region_id) + provision_service.invalidate_social_models(region_id) + engineering_service.invalidate_engineering_models(region_id)
+
+async def _apply_invalidations():
+    # invalidations requested from the other workers of the deployment
+    while True:
+        await asyncio.sleep(INVALIDATIONS_CHECK_INTERVAL)
+        try:
+            for region_id in await asyncio.to_thread(cache.pop_invalidations):
+                count = _invalidate(region_id)
+                logger.info(f'Invalidated {count} cache entries for {"all regions" if region_id is None else region_id} by another worker')
+        except Exception as e:
+            logger.error(f'Failed to apply cache invalidations: {e}')
+
+async def on_startup():
+    global _invalidations_task
+    # caches are empty on startup, earlier invalidations are of no use
+    await asyncio.to_thread(cache.pop_invalidations)
+    _invalidations_task = asyncio.create_task(_apply_invalidations())
+
+async def on_shutdown():
+    if _invalidations_task is not None:
+        _invalidations_task.cancel()
+
+router = APIRouter(prefix='/admin', tags=['Administration'])
+
+@router.get('/cache')
+async def get_cache_stats(token : str = Depends(verify_token)) -> dict[str, dict[str, int]]:
+    return {
+        'reference': cache.reference_cache.stats,
+        'provisions': provision_store.frames_cache.stats,
+        'tiles': tiles.tiles_cache.stats,
+        'social_models': provision_service.social_models_cache.stats,
+        'engineering_models': engineering_service.engineering_models_cache.stats,
+    }
+
+@router.get('/compute')
+async def get_compute_stats(token : str = Depends(verify_token)) -> dict[str, dict[str, float]]:
+    return compute.get_stats()
+
+@router.delete('/cache')
+async def invalidate_cache(region_id : int | None = None, token : str = Depends(verify_token)) -> int:
+    count = _invalidate(region_id)
+    # the other workers pick the invalidation up within INVALIDATIONS_CHECK_INTERVAL
+    await asyncio.to_thread(cache.mark_invalidated, region_id)
+    logger.info(f'Invalidated {count} cache entries for {"all regions" if region_id is None else region_id}')
+    return count
@@ -1,13 +1,11 @@
-import requests
+import asyncio
 import geopandas as gpd
-import shapely
 import pandas as pd
 from typing import Any, Dict
 from loguru import logger
-import json
 from enum import Enum
 from townsnet.engineering.engineer_potential import InfrastructureAnalyzer
-from ...utils.const import URBAN_API
+from ...utils import api_client, http_client, compute, indicators_writer, objects_store
 
 # Enums for engineering object types
 class EngineeringObject(Enum):
@@ -17,7 +15,8 @@ class EngineeringObject(Enum):
     WATER_SUPPLY = 'Водоснабжение'
     WATER_DRAINAGE = 'Водоотведение'
 
-PAGE_SIZE = 10_000
+PAGE_SIZE = api_client.PAGE_SIZE
+ENGINEERING_INDICATOR_ID = 204
 
 ENG_OBJ = {
     EngineeringObject.POWER_SUPPLY: [
@@ -36,91 +35,78 @@ ENG_OBJ = {
         24, 37, 39, 14  # Сети водоотведения, сооружения для очистки воды, водоочистные сооружения
     ]
 }
-# Utility Functions
-def fetch_physical_objects(region_id: int, pot_id: int, page: int, page_size: int = PAGE_SIZE):
-    response = requests.get(
-        f'{URBAN_API}/api/v1/territory/{region_id}/physical_objects_with_geometry',
-        params={'physical_object_type_id': pot_id, 'page': page, 'page_size': page_size}
-    )
-    response.raise_for_status()
-    return response.json()
+def _concat_objects(gdfs: list[gpd.GeoDataFrame | None]) -> gpd.GeoDataFrame:
+    gdfs = [gdf.reset_index() for gdf in gdfs if gdf is not None]
+    if len(gdfs) == 0:
+        return gpd.GeoDataFrame(columns=['geometry'], crs=4326)
+    return pd.concat(gdfs).set_geometry('geometry').set_crs(4326)
 
-def get_physical_objects(region_id: int, pot_id: int):
-    results = []
-    page = 1
-    while True:
-        data = fetch_physical_objects(region_id, pot_id, page)
-        results.extend(data['results'])
-        if data['next'] is None:
-            break
-        page += 1
+# Async functions
+async def get_physical_objects_async(region_id: int, pot_id: int, refresh: bool = False) -> gpd.GeoDataFrame:
+    gdf = await objects_store.get_physical_objects(region_id, pot_id, refresh)
+    return _concat_objects([gdf])
 
-    results_with_geometry = [
-        {**result, 'geometry': shapely.from_geojson(json.dumps(result['geometry']))}
-        for result in results if result.get('geometry')
-    ]
+async def fetch_required_objects_async(region_id: int, pot_ids: list[int], refresh: bool = False) -> gpd.GeoDataFrame:
+    pots_gdfs = await objects_store.get_physical_objects_many(region_id, pot_ids, refresh)
+    return _concat_objects(list(pots_gdfs.values()))
 
-    if not results_with_geometry:
-        return gpd.GeoDataFrame(columns=['geometry'])
+async def fetch_engineering_objects_async(region_id: int, refresh: bool = False) -> Dict[EngineeringObject, gpd.GeoDataFrame]:
+    # types shared by several groups (e.g. 13 and 14) are read once for all of them
+    groups_gdfs = await objects_store.fetch_groups(region_id, ENG_OBJ, refresh)
+    return {eng_obj : _concat_objects(gdfs) for eng_obj, gdfs in groups_gdfs.items()}
 
-    return gpd.GeoDataFrame(results_with_geometry).set_geometry('geometry').set_crs(4326)
+async def retrieve_project_and_territory_async(project_scenario_id: int, token: str):
+    scenario_data = await api_client.get_scenario_by_id(project_scenario_id, token)
+    project_id = scenario_data.get("project", {}).get("project_id")
+    if project_id is None:
+        raise Exception("Project ID is missing in scenario data.")
+    
+    territory_data = await api_client.get_project_by_id(project_id, token)
+    return territory_data["geometry"]
+
+async def analyze_and_save_results_async(analyzer: InfrastructureAnalyzer, project_scenario_id: int, token: str):
+    results = await compute.run(compute.ENGINEERING_KIND, analyzer.get_results)
+    payloads = [api_client.get_scenario_indicator_payload(
+        ENGINEERING_INDICATOR_ID,
+        project_scenario_id,
+        float(score),
+        comment='_',
+        information_source="modeled",
+        properties={
+            "attribute_name": "Обеспечение инженерной инфраструктурой"
+        }
+    ) for score in results['score']]
+    report = await indicators_writer.write(lambda payload : api_client.put_scenario_indicator_value(payload, token), payloads)
+    if len(report.failed) > 0:
+        raise Exception("Error saving indicators")
+
+# Sync wrappers
+def fetch_physical_objects(region_id: int, pot_id: int, page: int, page_size: int = PAGE_SIZE):
+    return http_client.run_sync(api_client._get_physical_objects(region_id, pot_id, page, page_size))
+
+def get_physical_objects(region_id: int, pot_id: int):
+    return http_client.run_sync(get_physical_objects_async(region_id, pot_id))
 
 def fetch_required_objects(region_id: int, pot_ids: list[int]):
-    gdfs = [get_physical_objects(region_id, pot_id) for pot_id in pot_ids]
-    return pd.concat(gdfs).set_geometry('geometry').set_crs(4326)
+    return http_client.run_sync(fetch_required_objects_async(region_id, pot_ids))
 
 def combine_engineering_gdfs(data_dict: Dict[EngineeringObject, gpd.GeoDataFrame]) -> gpd.GeoDataFrame:
-    combined_gdf = gpd.GeoDataFrame(columns=['type', 'geometry'], crs="EPSG:4326")
-    for eng_obj, gdf in data_dict.items():
-        gdf['type'] = eng_obj.value
-        combined_gdf = pd.concat([combined_gdf, gdf], ignore_index=True)
-    return combined_gdf
+    empty_gdf = gpd.GeoDataFrame(columns=['type', 'geometry'], crs="EPSG:4326")
+    gdfs = [gdf.assign(type=eng_obj.value) for eng_obj, gdf in data_dict.items()]
+    return pd.concat([empty_gdf, *gdfs], ignore_index=True)
 
 def retrieve_project_and_territory(project_scenario_id: int, token: str):
-    headers = {"Authorization": f"Bearer {token}"}
-    
-    scenario_response = requests.get(f"{URBAN_API}/api/v1/scenarios/{project_scenario_id}", headers=headers)
-    scenario_response.raise_for_status()
-    scenario_data = scenario_response.json()
-    project_id = scenario_data.get("project", {}).get("project_id")
-    if project_id is None:
-        raise Exception("Project ID is missing in scenario data.")
-    
-    territory_response = requests.get(f"{URBAN_API}/api/v1/projects/{project_id}/territory", headers=headers)
-    territory_response.raise_for_status()
-    territory_geometry = territory_response.json()["geometry"]
-    
-    return territory_geometry
+    return http_client.run_sync(retrieve_project_and_territory_async(project_scenario_id, token))
 
 def analyze_and_save_results(analyzer: InfrastructureAnalyzer, project_scenario_id: int, token: str):
-    results = analyzer.get_results()
-    for res in results.to_dict("records"):
-        indicator_data = {
-            "indicator_id": 204,
-            "scenario_id": project_scenario_id,
-            "territory_id": None,
-            "hexagon_id": None,
-            "value": float(res['score']),
-            "comment": '_',
-            "information_source": "modeled",
-             "properties": {
-                "attribute_name": "Обеспечение инженерной инфраструктурой"
-            }
-        }
-
-        response = requests.put(
-            f"{URBAN_API}/api/v1/scenarios/indicators_values",
-            headers={"Authorization": f"Bearer {token}"},
-            json=indicator_data
-        )
-        if response.status_code not in (200, 201):
-            logger.error(f"Error saving indicators: {response.status_code}, Response body: {response.text}")
-            raise Exception("Error saving indicators")
+    return http_client.run_sync(analyze_and_save_results_async(analyzer, project_scenario_id, token))
 
 async def process_engineer(region_id: int, project_scenario_id: int, token: str):
     try:
-        territory_geometry = retrieve_project_and_territory(project_scenario_id, token)
-        gdfs = {eng_obj: fetch_required_objects(region_id, pot_ids) for eng_obj, pot_ids in ENG_OBJ.items()}
+        territory_geometry, gdfs = await asyncio.gather(
+            retrieve_project_and_territory_async(project_scenario_id, token),
+            fetch_engineering_objects_async(region_id)
+        )
         combined_gdf = combine_engineering_gdfs(gdfs)
         territory_feature = {
             'type': 'Feature',
@@ -130,6 +116,7 @@ async def process_engineer(region_id: int, project_scenario_id: int, token: str)
         polygon_gdf = gpd.GeoDataFrame.from_features([territory_feature], crs=4326)
         polygon_gdf = polygon_gdf.to_crs(combined_gdf.crs)
         analyzer = InfrastructureAnalyzer(combined_gdf, polygon_gdf)
-        analyze_and_save_results(analyzer, project_scenario_id, token)
+        await analyze_and_save_results_async(analyzer, project_scenario_id, token)
     except Exception as e:
         logger.error(f"Error during engineer processing: {e}")
+        raise
@@ -1,18 +1,38 @@
-from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks, Query
+from fastapi import APIRouter, HTTPException, Depends, Query
 from townsnet.engineering.engineer_potential import InfrastructureAnalyzer
 from pydantic_geojson import FeatureCollectionModel, PolygonModel, MultiPolygonModel
-from ...utils import decorators
+from ...utils import decorators, tiles, jobs, compute, warmup
 from . import engineering_service, engineering_models, engineer_potential_service
-from ...utils.const import EVALUATION_RESPONSE_MESSAGE
+from ..jobs import jobs_models
 from app.utils.auth import verify_token 
+import asyncio
 import geopandas as gpd
 from loguru import logger
 
+REFRESH_CHECK_INTERVAL = 10 * 60
+
+_refresh_task : asyncio.Task | None = None
+
+async def _refresh_physical_objects():
+    while True:
+        # every worker checks, the one holding the lock refreshes and the others find nothing stale afterwards
+        lock_file = warmup.try_lock(engineering_service.WARMUP_COMPONENT)
+        if lock_file is not None:
+            try:
+                await engineering_service.refresh_stale_physical_objects()
+            except Exception as e:
+                logger.error(f'Failed to refresh physical objects: {e}')
+            finally:
+                warmup.release(lock_file)
+        await asyncio.sleep(REFRESH_CHECK_INTERVAL)
+
 async def on_startup():
-    ...
+    global _refresh_task
+    _refresh_task = asyncio.create_task(_refresh_physical_objects())
 
 async def on_shutdown():
-    ...
+    if _refresh_task is not None:
+        _refresh_task.cancel()
 
 router = APIRouter(prefix='/engineering', tags=['Engineering assessment'])
 
@@ -26,28 +46,35 @@ async def get_levels(region_id : int) -> dict[int, str]:
     levels = await engineering_service.fetch_levels(region_id)
     return levels
 
-@router.get('/{region_id}/get_evaluation')
-@decorators.gdf_to_geojson
-async def get_evaluation(region_id : int, level : int) -> engineering_models.EngineeringModel :
-    engineering_model = await engineering_service.fetch_engineering_model(region_id)
-    units = await engineering_service.fetch_units(region_id, level)
-    return engineering_service.aggregate(engineering_model, units)
+@router.get('/{region_id}/get_evaluation', responses=decorators.FORMATS_RESPONSES)
+@decorators.gdf_to_geojson(grid_size=decorators.PRECISION_GRID_SIZE)
+async def get_evaluation(region_id : int, level : int, refresh : bool = False) -> engineering_models.EngineeringModel :
+    return await engineering_service.get_evaluation(region_id, level, refresh)
+
+@router.get('/{region_id}/tiles/{z}/{x}/{y}', response_class=tiles.TileResponse)
+async def get_evaluation_tile(region_id : int, z : int, x : int, y : int, level : int):
+    # tiles built from older snapshots are not served once any worker rewrites them
+    snapshots_version = await engineering_service.get_snapshots_version(region_id)
+    layer_key = (__name__, region_id, level, snapshots_version)
+    return await tiles.get_tile(region_id, layer_key, z, x, y, 'engineering', lambda : engineering_service.get_evaluation(region_id, level))
 
 @router.put("/{region_id}/evaluate_region")
 async def evaluate_region_endpoint(
     region_id: int,
     regional_scenario_id: int | None = None,
-    background_tasks: BackgroundTasks = BackgroundTasks(),
     token: str = Depends(verify_token)
-    ):
-    background_tasks.add_task(engineering_service.process_region_evaluation, region_id, regional_scenario_id, token)
-    return EVALUATION_RESPONSE_MESSAGE
+    ) -> jobs_models.Job:
+    job_id = await jobs.job_manager.submit(
+        'engineering_region', engineering_service.process_region_evaluation, region_id, regional_scenario_id, token,
+        region_id=region_id, scenario_id=regional_scenario_id, priority=jobs.REGION_PRIORITY
+    )
+    return await asyncio.to_thread(jobs.get_job, job_id)
 
 
 @router.post('/{region_id}/evaluate_geojson')
-async def engineer_potential_hex_endpoint(region_id: int, geojson_data: dict):
+async def engineer_potential_hex_endpoint(region_id: int, geojson_data: dict, refresh: bool = False):
     try:
-        gdfs = {eng_obj: engineer_potential_service.fetch_required_objects(region_id, pot_ids) for eng_obj, pot_ids in engineer_potential_service.ENG_OBJ.items()}
+        gdfs = await engineer_potential_service.fetch_engineering_objects_async(region_id, refresh)
         combined_gdf = engineer_potential_service.combine_engineering_gdfs(gdfs)
 
         if geojson_data.get("type") != "FeatureCollection":
@@ -55,7 +82,7 @@ async def engineer_potential_hex_endpoint(region_id: int, geojson_data: dict):
 
         polygon_gdf = gpd.GeoDataFrame.from_features(geojson_data["features"], crs=4326).to_crs(combined_gdf.crs)
         analyzer = InfrastructureAnalyzer(combined_gdf, polygon_gdf)
-        results = analyzer.get_results()
+        results = await compute.run(compute.ENGINEERING_KIND, analyzer.get_results)
         if results.empty:
             raise HTTPException(status_code=404, detail="No results found.")
         
@@ -65,7 +92,9 @@ async def engineer_potential_hex_endpoint(region_id: int, geojson_data: dict):
         raise HTTPException(status_code=400, detail=str(e))
 
 @router.put('/{region_id}/evaluate_project')
-async def save_engineer_potential_endpoint(region_id: int, background_tasks: BackgroundTasks, project_scenario_id: int, token: str = Depends(verify_token)):
-    
-    background_tasks.add_task(engineer_potential_service.process_engineer, region_id, project_scenario_id, token)
-    return EVALUATION_RESPONSE_MESSAGE
\ No newline at end of file
+async def save_engineer_potential_endpoint(region_id: int, project_scenario_id: int, token: str = Depends(verify_token)) -> jobs_models.Job:
+    job_id = await jobs.job_manager.submit(
+        'engineering_project', engineer_potential_service.process_engineer, region_id, project_scenario_id, token,
+        region_id=region_id, scenario_id=project_scenario_id, priority=jobs.PROJECT_PRIORITY
+    )
+    return await asyncio.to_thread(jobs.get_job, job_id)
\ No newline at end of file
@@ -1,12 +1,14 @@
+import asyncio
 import pandas as pd
 import geopandas as gpd
 from townsnet.engineering.engineering_model import EngineeringModel, EngineeringObject
-from ...utils import api_client
+from ...utils import api_client, jobs, compute, indicators_writer, tiles, objects_store, warmup, metrics
+from ...utils.territory_index import get_territory_index
+from ...utils.cache import TTLCache, cached, invalidate_region
 from .engineering_models import Indicator, PhysicalObjectType
-from ...utils.const import EVALUATION_RESPONSE_MESSAGE, URBAN_API
+from . import engineer_potential_service
+from ...utils.const import EVALUATION_RESPONSE_MESSAGE, ENGINEERING_MODELS_CACHE_MAX_BYTES
 from datetime import datetime
-from datetime import date
-import requests
 from app.utils.auth import verify_token 
 from loguru import logger
 
@@ -38,45 +40,95 @@ ENG_OBJ_INDICATOR = {
     EngineeringObject.GAS_DISTRIBUTION : 93
 }
 
+# types of both engineering assessment and engineering potential, kept in the local snapshots
+PHYSICAL_OBJECTS_TYPES_IDS = sorted({pot_id for pots_ids in [*ENG_OBJ_POTS.values(), *engineer_potential_service.ENG_OBJ.values()] for pot_id in pots_ids})
+ENGINEERING_TYPES_IDS = sorted({pot_id for pots_ids in ENG_OBJ_POTS.values() for pot_id in pots_ids})
+WARMUP_COMPONENT = 'physical_objects'
+
+ENGINEERING_MODELS_TTL = 6 * 60 * 60
+engineering_models_cache = TTLCache(ENGINEERING_MODELS_CACHE_MAX_BYTES)
+
+_snapshots_versions : dict[int, tuple] = {}
+
+async def get_snapshots_version(region_id : int) -> tuple:
+    """
+    Version of the region engineering snapshots, models built from older snapshots are dropped when it changes
+    """
+    snapshots_version = await objects_store.get_version(region_id, ENGINEERING_TYPES_IDS)
+    # snapshots may be rewritten by another worker, its caches are not shared with this one
+    if _snapshots_versions.get(region_id, snapshots_version) != snapshots_version:
+        invalidate_engineering_models(region_id)
+    _snapshots_versions[region_id] = snapshots_version
+    return snapshots_version
+
+@cached(ENGINEERING_MODELS_TTL, region_arg='region_id', cache=engineering_models_cache)
+async def _fetch_engineering_model(region_id : int, snapshots_version : tuple) -> EngineeringModel:
+    groups = {eng_obj : pots_ids for eng_obj, pots_ids in ENG_OBJ_POTS.items() if len(pots_ids) > 0}
+    groups_gdfs = await objects_store.fetch_groups(region_id, groups)
+    gdfs = {eng_obj : pd.concat(pots_gdfs) for eng_obj, pots_gdfs in groups_gdfs.items()}
+    return await compute.run(compute.ENGINEERING_KIND, EngineeringModel, gdfs)
+
 async def fetch_engineering_model(region_id : int) -> EngineeringModel:
-    eng_objs_queries = {}
-    #sending queries
-    for eng_obj, pots_ids in ENG_OBJ_POTS.items():
-        eng_obj_queries = []
-        for pot_id in pots_ids:
-            pot_query = api_client.get_physical_objects(region_id, pot_id)
-            eng_obj_queries.append(pot_query)
-        if len(eng_obj_queries) > 0:
-            eng_objs_queries[eng_obj] = eng_obj_queries
-    #awaiting queries'
-    gdfs = {}
-    for eng_obj, queries in eng_objs_queries.items():
-        if len(queries)>0:
-            queries_gdfs = [await query for query in queries]
-            gdf = pd.concat(queries_gdfs)
-            gdfs[eng_obj] = gdf
-    return EngineeringModel(gdfs)
+    """
+    Region engineering model, physical objects of all types are read at once and the model is built once per snapshots version
+    """
+    snapshots_version = await get_snapshots_version(region_id)
+    return await _fetch_engineering_model(region_id, snapshots_version)
+
+@cached(ENGINEERING_MODELS_TTL, region_arg='region_id', cache=engineering_models_cache)
+async def _get_evaluation(region_id : int, level : int, snapshots_version : tuple) -> gpd.GeoDataFrame:
+    with metrics.stage('fetch'):
+        engineering_model = await _fetch_engineering_model(region_id, snapshots_version)
+        units = await fetch_units(region_id, level)
+    with metrics.stage('aggregate'):
+        return await compute.run(compute.ENGINEERING_KIND, aggregate, engineering_model, units)
+
+async def get_evaluation(region_id : int, level : int, refresh : bool = False) -> gpd.GeoDataFrame:
+    """
+    Region units of the level with engineering objects counts, memoized along with the region model.
+    Refresh syncs the region physical objects with the upstream first instead of relying on the snapshots
+    """
+    if refresh:
+        await refresh_physical_objects(region_id)
+    snapshots_version = await get_snapshots_version(region_id)
+    return await _get_evaluation(region_id, level, snapshots_version)
+
+def invalidate_engineering_models(region_id : int | None = None) -> int:
+    return invalidate_region(region_id, engineering_models_cache)
+
+async def refresh_physical_objects(region_id : int, stale_only : bool = False) -> bool:
+    """
+    Sync the region physical objects snapshots, dropping the region models and tiles if any objects changed
+    """
+    pots_ids = PHYSICAL_OBJECTS_TYPES_IDS
+    if stale_only:
+        are_stale = await asyncio.gather(*[asyncio.to_thread(objects_store.is_stale, region_id, pot_id) for pot_id in pots_ids])
+        pots_ids = [pot_id for pot_id, is_stale in zip(pots_ids, are_stale) if is_stale]
+    changes = await asyncio.gather(*[objects_store.sync(region_id, pot_id) for pot_id in pots_ids])
+    if any(changes):
+        invalidate_engineering_models(region_id)
+        tiles.invalidate_tiles(region_id)
+    return any(changes)
+
+async def refresh_stale_physical_objects():
+    """
+    Sync missing and outdated snapshots of all known regions
+    """
+    regions_df = await api_client.get_regions()
+    for region_id in regions_df.index:
+        try:
+            await refresh_physical_objects(region_id, stale_only=True)
+            warmup.mark_warm(region_id, WARMUP_COMPONENT)
+        except Exception as e:
+            logger.error(f'Failed to refresh {region_id} physical objects: {e}')
 
 async def fetch_units(region_id : int, level : int) -> gpd.GeoDataFrame:
-    if level == 2: #return region gdf
-        territories_gdf = await api_client.get_regions(True)
-        territories_gdf = territories_gdf[territories_gdf.index == region_id]
-    else: #return certain gdf
-        territories_gdf = await api_client.get_territories(region_id, all_levels = True, geometry=True)
-        territories_gdf = territories_gdf[territories_gdf['level'] == level]
-    return territories_gdf
+    territory_index = await get_territory_index(region_id)
+    return territory_index.get_territories(level)
 
 async def fetch_levels(region_id : int) -> dict[int, str]:
-    regions = await api_client.get_regions()
-    territories_gdf = await api_client.get_territories(region_id, all_levels = True)
-    levels = {
-        2 : regions.loc[region_id, 'territory_type']['name']
-    }
-    for level, gdf in territories_gdf.groupby('level'):
-        gdf['territory_type_name'] = gdf['territory_type'].apply(lambda tt : tt['name'])
-        ttn = max(gdf['territory_type_name'].unique(), key=lambda ttn : len(gdf[gdf['territory_type_name'] == ttn]))
-        levels[level] = ttn
-    return levels
+    territory_index = await get_territory_index(region_id)
+    return dict(territory_index.levels_names)
 
 async def get_indicators() -> list[Indicator]:
     indicators_pots = {ENG_OBJ_INDICATOR[eng_obj]: ENG_OBJ_POTS[eng_obj] for eng_obj in list(EngineeringObject)}
@@ -101,68 +153,51 @@ def aggregate(engineering_model : EngineeringModel, units : gpd.GeoDataFrame) ->
     return agg
     # return {i : {ENG_OBJ_INDICATOR[eng_obj] : agg.loc[i, eng_obj.value] for eng_obj in list(EngineeringObject)} for i in agg.index}
 
+REGION_INDICATORS_COLUMNS = {
+    89: "Электростанция",
+    90: "Водозабор",
+    91: "Водоочистительное сооружение",
+    92: "Водохранилище",
+    93: "Газораспределительная станция"
+}
+REGION_TOTAL_INDICATOR_ID = 88
+REGION_LEVELS = [2, 3, 4]
+REGION_INFORMATION_SOURCE = "modeled TownsNet"
+
+def get_indicators_values(engineer : gpd.GeoDataFrame) -> pd.DataFrame:
+    """
+    Level units indicators values with indicators ids columns, total is the sum of all engineering objects
+    """
+    values_df = engineer.reindex(columns=list(REGION_INDICATORS_COLUMNS.values()), fill_value=0).astype(float)
+    values_df.columns = list(REGION_INDICATORS_COLUMNS.keys())
+    values_df.insert(0, REGION_TOTAL_INDICATOR_ID, values_df.sum(axis=1))
+    return values_df
+
 async def process_region_evaluation(
     region_id: int, 
     regional_scenario_id: int | None, 
     token: str
 ):
     try:
-        levels = [2, 3, 4]
-        # levels = [2]
-        indicators = [
-            {"indicator_id": 88, "column": None},
-            {"indicator_id": 89, "column": "Электростанция"},
-            {"indicator_id": 90, "column": "Водозабор"},
-            {"indicator_id": 91, "column": "Водоочистительное сооружение"},
-            {"indicator_id": 92, "column": "Водохранилище"},
-            {"indicator_id": 93, "column": "Газораспределительная станция"}
-        ]
-
-        engineering_model = await fetch_engineering_model(region_id)
-
-        for level in levels:
-            units = await fetch_units(region_id, level)
-            engineer = aggregate(engineering_model, units)
-            engineer = engineer.reset_index()
-
-            for indicator in indicators:
-                indicator_id = indicator["indicator_id"]
-                column = indicator["column"]
-
-                for _, row in engineer.iterrows():
-                    if column:
-                        value = float(row.get(column, 0))
-                    else:
-                        value = sum(
-                            float(row.get(col, 0)) for col in [
-                                "Электростанция",
-                                "Водозабор",
-                                "Водоочистительное сооружение",
-                                "Водохранилище",
-                                "Газораспределительная станция"
-                            ]
-                        )
-
-                    indicator_data = {
-                        "indicator_id": indicator_id,
-                        "territory_id": row["territory_id"],
-                        "date_type": "day",
-                        "date_value": datetime.now().strftime("%Y-%m-%d"),
-                        "value": value,
-                        "value_type": "real",
-                        "information_source": "modeled TownsNet"
-                    }
-
-                    response = requests.put(
-                        f"{URBAN_API}/api/v1/indicator_value",
-                        json=indicator_data
-                    )
-
-                    if response.status_code not in (200, 201):
-                        logger.error(
-                            f"Error saving indicators: {response.status_code}, Response body: {response.text}"
-                        )
-                        raise Exception("Error saving indicators")
+        # region evaluation is the way to pick up changed physical objects without waiting for the refresher
+        await refresh_physical_objects(region_id)
+
+        levels_values = []
+        for i, level in enumerate(REGION_LEVELS):
+            jobs.set_progress(i / (len(REGION_LEVELS) + 1), f'Evaluating {level} level')
+            engineer = await get_evaluation(region_id, level)
+            levels_values.append(get_indicators_values(engineer))
+
+        jobs.set_progress(len(REGION_LEVELS) / (len(REGION_LEVELS) + 1), 'Saving indicators')
+        payloads = api_client.get_indicators_values_payloads(
+            pd.concat(levels_values),
+            datetime.now().strftime("%Y-%m-%d"),
+            REGION_INFORMATION_SOURCE
+        )
+        report = await indicators_writer.write(api_client.put_indicator_value, payloads)
+        if len(report.failed) > 0:
+            raise Exception(f"Error saving indicators: {report}")
 
     except Exception as e:
-        logger.error(f"Error during region evaluation: {e}")
\ No newline at end of file
+        logger.error(f"Error during region evaluation: {e}")
+        raise
@@ -0,0 +1,36 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from ...utils import warmup
+from ..provision import provision_controller
+from ..hex import hex_service
+from ..engineering import engineering_service
+
+WARMUP_COMPONENTS = [provision_controller.WARMUP_COMPONENT, hex_service.WARMUP_COMPONENT, engineering_service.WARMUP_COMPONENT]
+
+_started = False
+
+async def on_startup():
+    global _started
+    # controllers are started in order, so every other controller is started by now
+    _started = True
+
+async def on_shutdown():
+    global _started
+    _started = False
+
+router = APIRouter(prefix='/health', tags=['Health'])
+
+@router.get('/live')
+async def live() -> dict[str, str]:
+    return {'status': 'alive'}
+
+@router.get('/ready')
+async def ready():
+    components = {
+        component : {
+            'warming_up': warmup.is_locked(component),
+            'warm_regions': warmup.get_warm_regions(component),
+        } for component in WARMUP_COMPONENTS
+    }
+    content = {'status': 'ready' if _started else 'starting', 'components': components}
+    return JSONResponse(content, status_code=200 if _started else 503)
@@ -1,17 +1,40 @@
+import asyncio
+from loguru import logger
 from fastapi import APIRouter, HTTPException, Depends
-from ...utils import decorators
+from ...utils import decorators, tiles, warmup
 from . import hex_service, hex_models
 
+_pregeneration_task : asyncio.Task | None = None
+
+async def _pregenerate(lock_file):
+    try:
+        await hex_service.pregenerate_hex_grids()
+    except Exception as e:
+        logger.error(f'Failed to pregenerate hex grids: {e}')
+    finally:
+        warmup.release(lock_file)
+
 async def on_startup():
-    ...
+    global _pregeneration_task
+    # grids are generated in the background by a single worker of the deployment
+    lock_file = warmup.try_lock(hex_service.WARMUP_COMPONENT)
+    if lock_file is None:
+        return
+    _pregeneration_task = asyncio.create_task(_pregenerate(lock_file))
 
 async def on_shutdown():
-    ...
+    if _pregeneration_task is not None:
+        _pregeneration_task.cancel()
 
 router = APIRouter(prefix='/hex', tags=['Hex grid generator'])
 
-@router.get('/generate')
+@router.get('/generate', responses=decorators.FORMATS_RESPONSES)
 @decorators.gdf_to_geojson
 async def generate_hex_grid(region_id : int) -> hex_models.HexGridModel:
     hex_grid = await hex_service.generate_hex_grid(region_id)
     return hex_grid
+
+@router.get('/tiles/{z}/{x}/{y}', response_class=tiles.TileResponse)
+async def get_hex_grid_tile(region_id : int, z : int, x : int, y : int):
+    layer_key = (__name__, region_id)
+    return await tiles.get_tile(region_id, layer_key, z, x, y, 'hex', lambda : hex_service.generate_hex_grid(region_id))
@@ -1,12 +1,71 @@
+import asyncio
+import glob
+import hashlib
+import json
+import os
+import shapely
 import geopandas as gpd
-from townsnet.potential.grid_generator import GridGenerator
-from ...utils import api_client
+from loguru import logger
+from townsnet.potential.grid_generator import GridGenerator, DEFAULT_RESOLUTION
+from ...utils import api_client, warmup, compute
+from ...utils.const import DATA_PATH
+
+HEX_GRIDS_PATH = os.path.join(DATA_PATH, 'hex_grids')
+WARMUP_COMPONENT = 'hex'
 
 async def _fetch_region_gdf(region_id : int):
+    # only the boundary is needed, so the cached regions list is used instead of the region territory index
     regions = await api_client.get_regions(True)
     return regions[regions.index == region_id]
 
-async def generate_hex_grid(region_id : int) -> gpd.GeoDataFrame:
+def get_fingerprint(region_gdf : gpd.GeoDataFrame, resolution : int = DEFAULT_RESOLUTION) -> str:
+    """
+    Fingerprint of the region boundary and generator parameters the grid is generated for
+    """
+    geometry = shapely.normalize(shapely.union_all(region_gdf.geometry.values))
+    parameters = json.dumps({'resolution': resolution, 'crs': str(region_gdf.crs)}).encode()
+    return hashlib.sha1(shapely.to_wkb(geometry) + parameters).hexdigest()
+
+def _get_grid_path(region_id : int, fingerprint : str) -> str:
+    return os.path.join(HEX_GRIDS_PATH, f'{region_id}_{fingerprint}.parquet')
+
+def _save_grid(grid_gdf : gpd.GeoDataFrame, region_id : int, fingerprint : str):
+    os.makedirs(HEX_GRIDS_PATH, exist_ok=True)
+    grid_path = _get_grid_path(region_id, fingerprint)
+    # written aside and swapped so readers never see a partial file
+    tmp_path = f'{grid_path}.{os.getpid()}.tmp'
+    grid_gdf.to_parquet(tmp_path)
+    os.replace(tmp_path, grid_path)
+    # grids of the previous region boundaries are of no use anymore
+    for path in glob.glob(os.path.join(HEX_GRIDS_PATH, f'{region_id}_*.parquet')):
+        if path != grid_path:
+            os.remove(path)
+
+async def generate_hex_grid(region_id : int, resolution : int = DEFAULT_RESOLUTION) -> gpd.GeoDataFrame:
+    """
+    Serve the stored region grid, generating it if the region boundary or generator parameters changed
+    """
     region_gdf = await _fetch_region_gdf(region_id)
-    gg = GridGenerator()
-    return gg.run(region_gdf)
\ No newline at end of file
+    # boundary union is too heavy for the event loop
+    fingerprint = await asyncio.to_thread(get_fingerprint, region_gdf, resolution)
+    grid_path = _get_grid_path(region_id, fingerprint)
+    if os.path.exists(grid_path):
+        return await asyncio.to_thread(gpd.read_parquet, grid_path)
+    logger.info(f'Generating {region_id} hex grid')
+    gg = GridGenerator(resolution)
+    grid_gdf = await compute.run(compute.HEX_KIND, gg.run, region_gdf)
+    await asyncio.to_thread(_save_grid, grid_gdf, region_id, fingerprint)
+    return grid_gdf
+
+async def pregenerate_hex_grids():
+    """
+    Generate missing grids of all known regions
+    """
+    regions_df = await api_client.get_regions()
+    for region_id in regions_df.index:
+        try:
+            await generate_hex_grid(region_id)
+            warmup.mark_warm(region_id, WARMUP_COMPONENT)
+        except Exception as e:
+            logger.error(f'Failed to generate {region_id} hex grid: {e}')
+    logger.success('Hex grids are pregenerated')
@@ -0,0 +1,23 @@
+import asyncio
+from fastapi import APIRouter, HTTPException
+from ...utils import jobs
+from . import jobs_models
+
+async def on_startup():
+    await jobs.job_manager.start()
+
+async def on_shutdown():
+    await jobs.job_manager.stop()
+
+router = APIRouter(prefix='/jobs', tags=['Jobs'])
+
+@router.get('')
+async def get_jobs(kind : str | None = None, region_id : int | None = None, status : jobs.JobStatus | None = None, limit : int = 100) -> list[jobs_models.Job]:
+    return await asyncio.to_thread(jobs.get_jobs, kind, region_id, status, limit)
+
+@router.get('/{job_id}')
+async def get_job(job_id : str) -> jobs_models.Job:
+    job = await asyncio.to_thread(jobs.get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f'Job {job_id} not found')
+    return job
@@ -0,0 +1,31 @@
+from pydantic import BaseModel, computed_field
+from ...utils.jobs import JobStatus
+
+class Job(BaseModel):
+    id : str
+    kind : str
+    region_id : int | None
+    scenario_id : int | None
+    priority : int
+    options : dict | None = None
+    status : JobStatus
+    progress : float | None
+    message : str | None
+    error : str | None
+    created_at : float
+    started_at : float | None
+    finished_at : float | None
+
+    @computed_field
+    @property
+    def queue_time(self) -> float | None:
+        if self.started_at is None:
+            return None
+        return self.started_at - self.created_at
+
+    @computed_field
+    @property
+    def run_time(self) -> float | None:
+        if self.started_at is None or self.finished_at is None:
+            return None
+        return self.finished_at - self.started_at
@@ -0,0 +1,27 @@
+import asyncio
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from ...utils import metrics, jobs, compute
+
+PROMETHEUS_MEDIA_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+def _collect_jobs() -> dict[tuple, float]:
+    # deployment-wide counts from the shared jobs table
+    return {(status.value,) : jobs.count_jobs(status) for status in [jobs.JobStatus.QUEUED, jobs.JobStatus.RUNNING]}
+
+jobs_gauge = metrics.Gauge('jobs', 'Active background jobs of all workers by status', ('status',), collect=_collect_jobs)
+jobs_queue_gauge = metrics.Gauge('jobs_queue_size', 'Jobs waiting in this worker queue', collect=lambda : {() : jobs.job_manager.queue_size})
+compute_pending_gauge = metrics.Gauge('compute_pending', 'Compute calls waiting or running by kind', ('kind',), collect=lambda : {(kind,) : stats['pending'] for kind, stats in compute.get_stats().items()})
+
+async def on_startup():
+    ...
+
+async def on_shutdown():
+    ...
+
+router = APIRouter(tags=['Metrics'])
+
+@router.get('/metrics', response_class=PlainTextResponse)
+async def get_metrics():
+    # jobs gauge reads the shared sqlite table
+    return PlainTextResponse(await asyncio.to_thread(metrics.render), media_type=PROMETHEUS_MEDIA_TYPE)
@@ -1,25 +1,62 @@
+import asyncio
 import geopandas as gpd
 from loguru import logger
-from fastapi import APIRouter, Depends, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException
 from townsnet.provision.service_type import ServiceType, Category
-from townsnet.provision.provision_model import ProvisionModel
-from ...utils import decorators, api_client
-from ...utils.const import EVALUATION_RESPONSE_MESSAGE
+from ...utils import decorators, api_client, tiles, jobs, warmup, compute, metrics
 from ...utils.auth import verify_token
-from . import provision_service, provision_models
+from ..jobs import jobs_models
+from . import provision_service, provision_models, provision_store
+
+WARMUP_COMPONENT = 'provision'
+
+_warmup_task : asyncio.Task | None = None
+
+async def submit_region_evaluation(region_id : int, regional_scenario_id : int | None = None, refresh_matrix : bool = False, reprobe_capacities : bool = False) -> str:
+    return await jobs.job_manager.submit(
+        'provision_region', provision_service.evaluate_and_save_region, region_id, regional_scenario_id, refresh_matrix, reprobe_capacities=reprobe_capacities,
+        region_id=region_id, scenario_id=regional_scenario_id, priority=jobs.REGION_PRIORITY,
+        options={'refresh_matrix': refresh_matrix, 'reprobe_capacities': reprobe_capacities}
+    )
+
+async def _warm_up(lock_file):
+    try:
+        logger.info('Fetching regions')
+        regions_df = await api_client.get_regions()
+        for region_id in regions_df.index:
+            # regions are evaluated by the regular region jobs, so requested evaluations of the region coalesce with the warmup
+            job_id = await submit_region_evaluation(int(region_id))
+            job = await jobs.wait(job_id)
+            if job is None or job['status'] == jobs.JobStatus.INTERRUPTED.value:
+                logger.warning(f'Provision warmup is interrupted at {region_id}')
+                return
+            if job['status'] == jobs.JobStatus.SUCCEEDED.value:
+                warmup.mark_warm(region_id, WARMUP_COMPONENT)
+            else:
+                logger.error(f'Failed to warm up {region_id}: {job["error"]}')
+        warmup.mark_completed(WARMUP_COMPONENT)
+    except Exception as e:
+        logger.error(f'Failed to warm up provisions: {e}')
+    finally:
+        warmup.release(lock_file)
 
 async def on_startup():
-    logger.info('Fetching regions')
-    regions_df = await api_client.get_regions()
-    for region_id in regions_df.index:
-        if region_id != 1 : continue # TODO убрать когда появятся другие регионы
-        try:
-            await provision_service.evaluate_and_save_region(region_id)
-        except Exception as e:
-            logger.error(e)
+    global _warmup_task
+    # regions are warmed up by a single worker of the deployment, the others start serving right away
+    lock_file = warmup.try_lock(WARMUP_COMPONENT)
+    if lock_file is None:
+        logger.info('Provision warmup is run by another worker')
+        return
+    await asyncio.to_thread(provision_store.migrate)
+    if await asyncio.to_thread(warmup.is_completed, WARMUP_COMPONENT):
+        logger.info('Provision warmup is already completed by this version')
+        warmup.release(lock_file)
+        return
+    _warmup_task = asyncio.create_task(_warm_up(lock_file))
 
 async def on_shutdown():
-    ...
+    if _warmup_task is not None:
+        _warmup_task.cancel()
 
 router = APIRouter(prefix='/provision', tags=['Provision assessment'])
 
@@ -36,42 +73,66 @@ async def get_service_types(region_id : int) -> list[ServiceType]:
     service_types = await provision_service.fetch_service_types(region_id)
     return list(service_types.values())
 
-@router.get('/{region_id}/get_evaluation')
-@decorators.gdf_to_geojson
-async def get_evaluation(region_id : int, level : int | None = None, category : Category | None = None, service_type_id : int | None = None, regional_scenario_id : int | None = None) -> provision_models.ProvisionModel :
-    
+async def _get_evaluation(region_id : int, level : int | None = None, category : Category | None = None, service_type_id : int | None = None, regional_scenario_id : int | None = None, weighted : bool = False) -> gpd.GeoDataFrame:
+
     # fetch service types
     logger.info(f'Fetching service types for {region_id}')
-    service_types = list((await provision_service.fetch_service_types(region_id)).values())
+    with metrics.stage('fetch'):
+        service_types = list((await provision_service.fetch_service_types(region_id)).values())
     if service_type_id is not None:
         service_types = [st for st in service_types if st.id == service_type_id]
     elif category is not None:
         service_types = [st for st in service_types if st.category == category]
+
+    # serve materialized merged layer if possible
+    if level is None and service_type_id is None:
+        evaluated_ids = set(await provision_service.get_evaluated_ids(region_id, regional_scenario_id))
+        evaluated_service_types = [st for st in service_types if st.id in evaluated_ids]
+        if len(evaluated_service_types) > 1:
+            with metrics.stage('load'):
+                provision = await provision_service.load_layer(region_id, evaluated_service_types, category, regional_scenario_id, weighted)
+            if provision is not None:
+                return provision
     
-    #load provisions
+    #load provisions, aggregated by units if needed
     logger.info(f'Loading indicators for {region_id}')
-    provisions = {st.id : await provision_service.load(region_id, st.id, regional_scenario_id) for st in service_types}
-
-    #aggregate if needed
-    if level is not None:
-        #fetch territories
-        logger.info('Fetching territories to aggregate')
-        units_gdfs, _ = await provision_service.fetch_territories(region_id)
-        units_gdf = units_gdfs[level][['geometry']]
-        logger.info('Aggregating')
-        for st in service_types:
-            provision =  provisions[st.id]
-            provision.index.name = '' # FIXME doesnt work without that
-            provisions[st.id] = ProvisionModel.agregate(provision, units_gdf)
+    service_types_ids = [st.id for st in service_types]
+    if level is None:
+        with metrics.stage('load'):
+            provisions = await provision_service.load_many(region_id, service_types_ids, regional_scenario_id)
+    else:
+        # times its loading and aggregation stages itself
+        provisions = await provision_service.load_aggregations(region_id, service_types_ids, level, regional_scenario_id)
+    service_types = [st for st in service_types if st.id in provisions]
+    if len(service_types) == 0:
+        raise HTTPException(status_code=404, detail=f'No evaluated provisions found for {region_id}')
 
     # merge service types provisions if required
     if len(service_types) > 1:
-        provision = provision_service.merge_provisions(provisions, service_types)
+        with metrics.stage('merge'):
+            provision = provision_service.merge_provisions(provisions, service_types, weighted)
     else:
         provision = list(provisions.values())[0]
 
     return provision
 
+@router.get('/{region_id}/get_evaluation', responses=decorators.FORMATS_RESPONSES)
+@decorators.gdf_to_geojson(names_mapping=provision_models.RU_NAMES_MAPPING, precision=provision_models.ROUND_PRECISION, grid_size=decorators.PRECISION_GRID_SIZE)
+async def get_evaluation(region_id : int, level : int | None = None, category : Category | None = None, service_type_id : int | None = None, regional_scenario_id : int | None = None, weighted : bool = False) -> provision_models.ProvisionModel :
+    return await _get_evaluation(region_id, level, category, service_type_id, regional_scenario_id, weighted)
+
+@router.get('/{region_id}/tiles/{z}/{x}/{y}', response_class=tiles.TileResponse)
+async def get_evaluation_tile(region_id : int, z : int, x : int, y : int, level : int | None = None, category : Category | None = None, service_type_id : int | None = None, regional_scenario_id : int | None = None, weighted : bool = False):
+    # tiles built from older provisions are not served once any worker rewrites them
+    provisions_version = await provision_service.get_provisions_version(region_id, regional_scenario_id)
+    layer_key = (__name__, region_id, level, category, service_type_id, regional_scenario_id, weighted, provisions_version)
+    return await tiles.get_tile(
+        region_id, layer_key, z, x, y, 'provision',
+        lambda : _get_evaluation(region_id, level, category, service_type_id, regional_scenario_id, weighted),
+        provision_models.RU_NAMES_MAPPING,
+        provision_models.ROUND_PRECISION
+    )
+
 @router.post('/{region_id}/get_evaluation')
 async def get_geojson_evaluation(region_id : int, geojson : provision_models.GridInputModel, regional_scenario_id : int | None = None) -> list[float]:
     
@@ -80,14 +141,18 @@ async def get_geojson_evaluation(region_id : int, geojson : provision_models.Gri
     social_model = await provision_service.fetch_social_model(region_id, regional_scenario_id)
 
     logger.info('Evaluating social score for each cell')
-    return grid_gdf.geometry.apply(lambda g : provision_service.evaluate_social(social_model, g)[0])
+    social_df = await compute.run(compute.SOCIAL_KIND, provision_service.evaluate_social_batch, social_model, grid_gdf.geometry)
+    return social_df['score'].tolist()
 
 @router.post('/{region_id}/evaluate_region')
-async def evaluate_region(background_tasks : BackgroundTasks, region_id : int, regional_scenario_id : int | None = None) -> str:
-    background_tasks.add_task(provision_service.evaluate_and_save_region, region_id, regional_scenario_id)
-    return EVALUATION_RESPONSE_MESSAGE
+async def evaluate_region(region_id : int, regional_scenario_id : int | None = None, refresh_matrix : bool = False, reprobe_capacities : bool = False) -> jobs_models.Job:
+    job_id = await submit_region_evaluation(region_id, regional_scenario_id, refresh_matrix, reprobe_capacities)
+    return await asyncio.to_thread(jobs.get_job, job_id)
 
 @router.post('/{region_id}/evaluate_project')
-async def evaluate_project(background_tasks : BackgroundTasks, region_id : int, project_scenario_id : int, token: str = Depends(verify_token)):
-    background_tasks.add_task(provision_service.evaluate_and_save_project, region_id, project_scenario_id, token)
-    return EVALUATION_RESPONSE_MESSAGE
\ No newline at end of file
+async def evaluate_project(region_id : int, project_scenario_id : int, token: str = Depends(verify_token)) -> jobs_models.Job:
+    job_id = await jobs.job_manager.submit(
+        'provision_project', provision_service.evaluate_and_save_project, region_id, project_scenario_id, token,
+        region_id=region_id, scenario_id=project_scenario_id, priority=jobs.PROJECT_PRIORITY
+    )
+    return await asyncio.to_thread(jobs.get_job, job_id)
\ No newline at end of file
@@ -1,17 +1,22 @@
+import asyncio
 import json
 import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import geopandas as gpd
 import pandas as pd
-from statistics import mean
 from loguru import logger
 import shapely
-from townsnet.provision.service_type import ServiceType, SupplyType, Category
+from townsnet.provision.service_type import ServiceType, SupplyType, Category, AccessibilityType
 from townsnet.provision.provision_model import ProvisionModel
 from townsnet.provision.social_model import SocialModel
 from shapely import Polygon, MultiPolygon
-from ...utils import api_client
-from ...utils.const import DATA_PATH
+from ...utils import api_client, matrix_store, tiles, jobs, compute, indicators_writer, metrics
+from ...utils.territory_index import get_territory_index
+from ...utils.cache import TTLCache, cached, invalidate_region
+from ...utils.const import DATA_PATH, PROVISION_WORKERS, SOCIAL_MODELS_CACHE_MAX_BYTES
+from . import provision_workers, provision_store
 
 CATEGORIES_WEIGHTS = {
     Category.BASIC: 3,
@@ -27,6 +32,19 @@ CATEGORIES_INDICATORS_IDS = {
     Category.COMFORT: 203
 }
 
+ALL_LAYER = 'all'
+WEIGHTED_PROVISION_COLUMN = 'weighted_provision'
+
+MAX_CAPACITY_LEVEL = 5
+CAPACITY_LEVELS_PATH = os.path.join(DATA_PATH, 'capacity_levels.json')
+_capacity_levels_lock = asyncio.Lock()
+
+# social models depend on service types and population, so they are not kept longer than those
+SOCIAL_MODELS_TTL = api_client.SERVICE_TYPES_TTL
+social_models_cache = TTLCache(SOCIAL_MODELS_CACHE_MAX_BYTES)
+_provisions_versions : dict[tuple[int, int | None], tuple] = {}
+_warmup_tasks : set[asyncio.Task] = set()
+
 async def fetch_service_types(region_id : int) -> dict[int, ServiceType]:
     """
     Fetch region specific service types with normatives
@@ -46,53 +64,76 @@ async def fetch_territories(region_id : int, regional_scenario_id : int | None =
     """
     Fetch region territories for specific regional_scenario with population (optional) and geometry (optional)
     """
-    # fetch region
-    regions_gdf = await api_client.get_regions(geometry)
-    region_gdf = regions_gdf[regions_gdf.index == region_id]
-    units_gdfs = {2 : region_gdf}
-    # fetch towns
-    territories_gdf = await api_client.get_territories(region_id, all_levels = True, geometry=geometry)
-    # territories_gdf['was_point'] = territories_gdf['properties'].apply(lambda p : p['was_point'] if 'was_point' in p else False)
-    #filter towns gdf
-    towns_gdf = territories_gdf[territories_gdf['is_city']]
+    territory_index = await get_territory_index(region_id)
+    units_gdfs = {level : territory_index.get_units(level) for level in territory_index.units_gdfs}
+    towns_gdf = territory_index.get_towns()
     if population:
         towns_gdf = await api_client.get_territories_population(towns_gdf)
         towns_gdf['population'] = towns_gdf['population'].fillna(0)
-    #filter units gdf
-    units_gdf = territories_gdf[~territories_gdf['is_city']]
-    levels = units_gdf['level'].unique()
-    # fetch population
-    for level in levels:
-        units_gdfs[level] = units_gdf[units_gdf.level == level]
+    if not geometry:
+        units_gdfs = {level : pd.DataFrame(gdf.drop(columns='geometry')) for level, gdf in units_gdfs.items()}
+        towns_gdf = pd.DataFrame(towns_gdf.drop(columns='geometry'))
     return units_gdfs, towns_gdf
 
 async def fetch_levels(region_id : int) -> dict[int, str]:
     """
     Fetch region levels
     """
-    units_gdfs, _ = await fetch_territories(region_id, population=False, geometry=False)
-    levels = {}
-    for level, gdf in units_gdfs.items():
-        gdf['territory_type_name'] = gdf['territory_type'].apply(lambda tt : tt['name'])
-        ttn = max(gdf['territory_type_name'].unique(), key=lambda ttn : len(gdf[gdf['territory_type_name'] == ttn]))
-        levels[level] = ttn
-    return levels
+    territory_index = await get_territory_index(region_id)
+    return dict(territory_index.units_levels_names)
 
-async def fetch_acc_mx(region_id : int, regional_scenario_id : int | None = None) -> pd.DataFrame:
+async def fetch_acc_mx(region_id : int, regional_scenario_id : int | None = None, fingerprint : str | None = None, refresh : bool = False) -> pd.DataFrame:
     """
-    Fetch region accessibility matrix from Transport Frames
+    Fetch region accessibility matrix from the local store, refreshing it from Transport Frames if needed
     """
-    acc_mx = await api_client.get_accessibility_matrix(region_id)
+    acc_mx = await matrix_store.get_accessibility_matrix(region_id, regional_scenario_id=regional_scenario_id, fingerprint=fingerprint, refresh=refresh)
     return acc_mx
 
-async def fetch_supplies(region_id : int, service_type : ServiceType):
-    level = 5
-    while level>0:
+def _read_capacity_levels() -> dict[str, dict[str, int]]:
+    if not os.path.exists(CAPACITY_LEVELS_PATH):
+        return {}
+    with open(CAPACITY_LEVELS_PATH) as f:
+        return json.load(f)
+
+def _write_capacity_level(region_id : int, service_type_id : int, level : int):
+    # reread before writing to keep levels resolved by other workers
+    capacity_levels = _read_capacity_levels()
+    capacity_levels.setdefault(str(region_id), {})[str(service_type_id)] = level
+    tmp_path = f'{CAPACITY_LEVELS_PATH}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(capacity_levels, f)
+    os.replace(tmp_path, CAPACITY_LEVELS_PATH)
+
+async def _probe_capacity_level(region_id : int, service_type_id : int) -> tuple[int | None, list[dict]]:
+    """
+    Request all capacity levels at once and pick the highest one with supplies
+    """
+    levels = list(range(MAX_CAPACITY_LEVEL, 0, -1))
+    levels_supplies = await asyncio.gather(*[api_client.get_service_type_capacities(region_id, level, service_type_id) for level in levels])
+    for level, supplies in zip(levels, levels_supplies):
+        if len(supplies) > 0:
+            return level, supplies
+    return None, []
+
+async def fetch_capacity_levels(region_id : int) -> dict[str, int]:
+    """
+    Region service types capacity levels resolved before, read once per evaluation and passed to fetch_supplies
+    """
+    capacity_levels = await asyncio.to_thread(_read_capacity_levels)
+    return capacity_levels.get(str(region_id), {})
+
+async def fetch_supplies(region_id : int, service_type : ServiceType, reprobe : bool = False, capacity_levels : dict[str, int] | None = None):
+    if capacity_levels is None and not reprobe:
+        capacity_levels = await fetch_capacity_levels(region_id)
+    level = None if reprobe else capacity_levels.get(str(service_type.id))
+    supplies = []
+    if level is not None:
         supplies = await api_client.get_service_type_capacities(region_id, level, service_type.id)
-        if len(supplies) == 0:
-            level -= 1
-        else:
-            break
+    if len(supplies) == 0:
+        level, supplies = await _probe_capacity_level(region_id, service_type.id)
+        if level is not None:
+            async with _capacity_levels_lock:
+                await asyncio.to_thread(_write_capacity_level, region_id, service_type.id, level)
     supplies_df = pd.DataFrame(supplies).set_index('territory_id')
     if service_type.supply_type == SupplyType.CAPACITY_PER_1000:
         supplies_df['supply'] = supplies_df['capacity']
@@ -100,62 +141,216 @@ async def fetch_supplies(region_id : int, service_type : ServiceType):
         supplies_df['supply'] = supplies_df['count']
     return supplies_df
 
-def merge_provisions(provisions : dict[int, gpd.GeoDataFrame], service_types : list[ServiceType]):
-    provision = list(provisions.values())[0][['geometry']].copy()
-    for st in service_types:
-        prov_gdf = provisions[st.id]
-        provision[st.name] = prov_gdf['provision']
-    provision['provision'] = provision.apply(lambda s : mean([s[st.name] for st in service_types if not np.isnan(s[st.name])]), axis=1)
+def merge_provisions(provisions : dict[int, gpd.GeoDataFrame], service_types : list[ServiceType], weighted : bool = False):
+    """
+    Merge service types provisions into one frame with mean provision ignoring NaNs, optionally weighted by service types weights
+    """
+    provision = provisions[service_types[0].id][['geometry']].copy()
+    values = pd.DataFrame({st.name : provisions[st.id]['provision'] for st in service_types}, index=provision.index)
+    if weighted:
+        weights = pd.Series([st.weight for st in service_types], index=[st.name for st in service_types])
+        weights = values.notna() * weights.groupby(level=0).last()
+        provision_values = (values.fillna(0) * weights).sum(axis=1) / weights.sum(axis=1).replace(0, np.nan)
+    else:
+        provision_values = values.mean(axis=1, skipna=True)
+    provision[values.columns] = values
+    provision['provision'] = provision_values
     return provision
 
-def _get_file_path(region_id : int, service_type_id : int, regional_scenario_id : int | None = None):
-    file_path = f'{region_id}_{service_type_id}'
-    if regional_scenario_id is not None:
-        file_path = f'{file_path}_{regional_scenario_id}'
-    return os.path.join(DATA_PATH, f'{file_path}.parquet')
+def get_layer_name(category : Category | None = None) -> str:
+    return ALL_LAYER if category is None else category.name.lower()
+
+def _save_layer(provisions : dict[int, gpd.GeoDataFrame], region_id : int, layer : str, service_types : list[ServiceType], regional_scenario_id : int | None = None):
+    layer_gdf = merge_provisions(provisions, service_types)
+    layer_gdf[WEIGHTED_PROVISION_COLUMN] = merge_provisions(provisions, service_types, weighted=True)['provision']
+    provision_store.save_layer(layer_gdf, region_id, layer, [st.id for st in service_types], regional_scenario_id)
 
-async def _exists(region_id : int, service_type_id : int, regional_scenario_id : int | None = None):
-    return os.path.exists(_get_file_path(region_id, service_type_id, regional_scenario_id))
+async def save_layers(region_id : int, service_types : list[ServiceType], regional_scenario_id : int | None = None):
+    """
+    Materialize merged provisions of each category and of all service types
+    """
+    provisions = await load_many(region_id, [st.id for st in service_types], regional_scenario_id)
+    service_types = [st for st in service_types if st.id in provisions]
+    layers_service_types = {get_layer_name() : service_types}
+    for category in list(Category):
+        layers_service_types[get_layer_name(category)] = [st for st in service_types if st.category == category]
+    for layer, layer_service_types in layers_service_types.items():
+        if len(layer_service_types) == 0:
+            continue
+        logger.info(f'Saving {layer} layer for {region_id}')
+        await asyncio.to_thread(_save_layer, provisions, region_id, layer, layer_service_types, regional_scenario_id)
+
+async def load_layer(region_id : int, service_types : list[ServiceType], category : Category | None = None, regional_scenario_id : int | None = None, weighted : bool = False) -> gpd.GeoDataFrame | None:
+    """
+    Load materialized merged layer if it was built from exactly the same service types
+    """
+    layer = await asyncio.to_thread(provision_store.load_layer, region_id, get_layer_name(category), regional_scenario_id)
+    if layer is None:
+        return None
+    layer_gdf, service_types_ids = layer
+    if set(service_types_ids) != {st.id for st in service_types}:
+        return None
+    if weighted:
+        layer_gdf['provision'] = layer_gdf[WEIGHTED_PROVISION_COLUMN]
+    return layer_gdf.drop(columns=WEIGHTED_PROVISION_COLUMN)
+
+def aggregate(provision_gdf : gpd.GeoDataFrame, units_gdf : gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    """
+    Aggregate town level provision by units
+    """
+    provision_gdf = provision_gdf.copy(deep=False)
+    provision_gdf.index.name = '' # FIXME doesnt work without that
+    return ProvisionModel.agregate(provision_gdf, units_gdf[['geometry']])
+
+async def save_aggregations(region_id : int, service_types : list[ServiceType], regional_scenario_id : int | None = None):
+    """
+    Aggregate evaluated provisions by units of every level missing in the store
+    """
+    units_gdfs, _ = await fetch_territories(region_id, regional_scenario_id, population=False)
+    for level, units_gdf in units_gdfs.items():
+        aggregated_ids = set(await get_evaluated_ids(region_id, regional_scenario_id, level))
+        service_types_ids = [st.id for st in service_types if st.id not in aggregated_ids]
+        provisions = await load_many(region_id, service_types_ids, regional_scenario_id)
+        if len(provisions) == 0:
+            continue
+        logger.info(f'Aggregating {len(provisions)} service types provisions by {level} level units of {region_id}')
+        for service_type_id, provision_gdf in provisions.items():
+            aggregation_gdf = await compute.run(compute.PROVISION_KIND, aggregate, provision_gdf, units_gdf)
+            await asyncio.to_thread(provision_store.save, aggregation_gdf, region_id, service_type_id, regional_scenario_id, level)
+
+async def load_aggregations(region_id : int, service_types_ids : list[int], level : int, regional_scenario_id : int | None = None) -> dict[int, gpd.GeoDataFrame]:
+    """
+    Load stored aggregations by units of the level, aggregating on the fly the service types missing in the store
+    """
+    with metrics.stage('load'):
+        aggregations = await asyncio.to_thread(provision_store.load_many, region_id, service_types_ids, regional_scenario_id, level=level)
+        missing_ids = [st_id for st_id in service_types_ids if st_id not in aggregations]
+        provisions = await load_many(region_id, missing_ids, regional_scenario_id)
+    if len(provisions) > 0:
+        logger.info(f'Aggregating {len(provisions)} service types provisions by {level} level units on the fly')
+        with metrics.stage('aggregate'):
+            units_gdfs, _ = await fetch_territories(region_id, regional_scenario_id, population=False)
+            for service_type_id, provision_gdf in provisions.items():
+                aggregations[service_type_id] = await compute.run(compute.PROVISION_KIND, aggregate, provision_gdf, units_gdfs[level])
+    return aggregations
+
+async def get_evaluated_ids(region_id : int, regional_scenario_id : int | None = None, level : int | None = None) -> list[int]:
+    """
+    Service types with provisions (or aggregations by units of the level) in the store
+    """
+    return await asyncio.to_thread(provision_store.get_service_types_ids, region_id, regional_scenario_id, level)
 
 async def load(region_id : int, service_type_id : int, regional_scenario_id : int | None = None):
-    file_path = _get_file_path(region_id, service_type_id, regional_scenario_id)
-    return gpd.read_parquet(file_path)
+    return await asyncio.to_thread(provision_store.load, region_id, service_type_id, regional_scenario_id)
+
+async def load_many(region_id : int, service_types_ids : list[int], regional_scenario_id : int | None = None, columns : list[str] | None = None) -> dict[int, gpd.GeoDataFrame]:
+    """
+    Load several service types provisions reading shared towns geometry once
+    """
+    return await asyncio.to_thread(provision_store.load_many, region_id, service_types_ids, regional_scenario_id, columns)
 
 async def _save(provision_gdf : gpd.GeoDataFrame, region_id : int, service_type_id : int, regional_scenario_id : int | None = None):
-    file_path = _get_file_path(region_id, service_type_id, regional_scenario_id)
-    provision_gdf.to_parquet(file_path)
+    await asyncio.to_thread(provision_store.save, provision_gdf, region_id, service_type_id, regional_scenario_id)
 
-async def evaluate_and_save_region(region_id : int, regional_scenario_id : int | None = None):
+async def _calculate_sequential(provision_model : ProvisionModel, region_id : int, service_types : list[ServiceType], regional_scenario_id : int | None = None, reprobe : bool = False):
+    capacity_levels = await fetch_capacity_levels(region_id)
+    for i, service_type in enumerate(service_types):
+        logger.info(f'Evaluating {service_type.id} service_type provision')
+        supplies_df = await fetch_supplies(region_id, service_type, reprobe, capacity_levels)
+        duration, provision = await compute.run(compute.PROVISION_KIND, metrics.measure, provision_model.calculate, supplies_df, service_type)
+        metrics.provision_calculations_seconds.observe(duration, service_type_id=service_type.id)
+        # и сохраняем их на будущее
+        await _save(provision, region_id, service_type.id, regional_scenario_id)
+        jobs.set_progress((i + 1) / len(service_types), f'Evaluated {service_type.name}')
+
+async def _calculate_parallel(towns_gdf : gpd.GeoDataFrame, region_id : int, service_types : list[ServiceType], regional_scenario_id : int | None = None, workers : int = PROVISION_WORKERS, reprobe : bool = False):
+    logger.info(f'Fetching supplies for {len(service_types)} service types')
+    capacity_levels = await fetch_capacity_levels(region_id)
+    supplies_dfs = await asyncio.gather(*[fetch_supplies(region_id, service_type, reprobe, capacity_levels) for service_type in service_types])
+    loop = asyncio.get_running_loop()
+    # workers map the stored matrix instead of receiving its pickled copy with every task
+    executor = ProcessPoolExecutor(
+        max_workers=min(workers, len(service_types)),
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=provision_workers.initialize,
+        initargs=(towns_gdf, region_id, regional_scenario_id)
+    )
+
+    evaluated_count = 0
+
+    async def _calculate(service_type : ServiceType, supplies_df : pd.DataFrame):
+        nonlocal evaluated_count
+        duration, provision = await loop.run_in_executor(executor, metrics.measure, provision_workers.calculate, supplies_df, service_type)
+        metrics.provision_calculations_seconds.observe(duration, service_type_id=service_type.id)
+        logger.info(f'Evaluated {service_type.id} service_type provision')
+        await _save(provision, region_id, service_type.id, regional_scenario_id)
+        evaluated_count += 1
+        jobs.set_progress(evaluated_count / len(service_types), f'Evaluated {service_type.name}')
+
+    try:
+        await asyncio.gather(*[_calculate(st, supplies_df) for st, supplies_df in zip(service_types, supplies_dfs)])
+    finally:
+        # waiting for the pool here would block the event loop
+        executor.shutdown(wait=False, cancel_futures=True)
+
+async def evaluate_and_save_region(region_id : int, regional_scenario_id : int | None = None, refresh_matrix : bool = False, workers : int = PROVISION_WORKERS, reprobe_capacities : bool = False):
 
     logger.info(f'Fetching {region_id} region service types')
     region_service_types = await fetch_service_types(region_id)
-    candidate_service_types = []
-    for service_type_id, service_type in region_service_types.items():
-        # если сервиса не существует, добавляем его в кандидаты на вычисление
-        if not await _exists(region_id, service_type_id, regional_scenario_id):
-            candidate_service_types.append(service_type)
+    evaluated_ids = set(await get_evaluated_ids(region_id, regional_scenario_id))
+    # если сервиса не существует, добавляем его в кандидаты на вычисление
+    candidate_service_types = [service_type for service_type_id, service_type in region_service_types.items() if service_type_id not in evaluated_ids]
     if len(candidate_service_types) == 0:
         logger.success('All service types are evaluated')
+        if not await asyncio.to_thread(provision_store.layer_exists, region_id, get_layer_name(), regional_scenario_id):
+            await save_layers(region_id, list(region_service_types.values()), regional_scenario_id)
+        await save_aggregations(region_id, list(region_service_types.values()), regional_scenario_id)
         return
     # инициализируем модельку
     logger.info(f'Initializing {region_id} region provision model')
-    try:
-        acc_mx = await fetch_acc_mx(region_id, regional_scenario_id)
-    except:
-        raise Exception(f'Problem with accessibility matrix for {region_id}')
     _, towns_gdf = await fetch_territories(region_id, regional_scenario_id) # TODO добавить агрегацию по юнитам
     if len(towns_gdf) == 0:
         raise Exception(f'No towns found for {region_id}')
-    provision_model = ProvisionModel(towns_gdf, acc_mx, verbose = False)
+    try:
+        fingerprint = matrix_store.get_fingerprint(towns_gdf.index)
+        acc_mx = await fetch_acc_mx(region_id, regional_scenario_id, fingerprint, refresh_matrix)
+    except:
+        raise Exception(f'Problem with accessibility matrix for {region_id}')
     # для каждого ненайденного типа сервисов цепляем емкости и считаем обеспеченность
-    for service_type in candidate_service_types:
-        logger.info(f'Evaluating {service_type.id} service_type provision')
-        supplies_df = await fetch_supplies(region_id, service_type)
-        provision = provision_model.calculate(supplies_df, service_type)
-        # и сохраняем их на будущее
-        await _save(provision, region_id, service_type.id, regional_scenario_id)
+    if workers > 1 and len(candidate_service_types) > 1:
+        await _calculate_parallel(towns_gdf, region_id, candidate_service_types, regional_scenario_id, workers, reprobe_capacities)
+    else:
+        provision_model = ProvisionModel(towns_gdf, matrix_store.NoCopyMatrix(acc_mx), verbose = False)
+        await _calculate_sequential(provision_model, region_id, candidate_service_types, regional_scenario_id, reprobe_capacities)
+    # merged layers and units aggregations are served to requests instead of computing them at request time
+    await save_layers(region_id, list(region_service_types.values()), regional_scenario_id)
+    await save_aggregations(region_id, list(region_service_types.values()), regional_scenario_id)
+    tiles.invalidate_tiles(region_id)
+    # social models built from the previous provisions are outdated now
+    invalidate_social_models(region_id)
+    warm_social_model(region_id, regional_scenario_id)
+
+async def get_provisions_version(region_id : int, regional_scenario_id : int | None = None) -> tuple:
+    """
+    Version of the region stored provisions, models built from older provisions are dropped when it changes
+    """
+    provisions_version = await asyncio.to_thread(provision_store.get_version, region_id, regional_scenario_id, get_layer_name())
+    # provisions may be rewritten by an evaluation in another worker, its caches are not shared with this one
+    version_key = (region_id, regional_scenario_id)
+    if _provisions_versions.get(version_key, provisions_version) != provisions_version:
+        invalidate_social_models(region_id)
+    _provisions_versions[version_key] = provisions_version
+    return provisions_version
 
 async def fetch_social_model(region_id : int, regional_scenario_id : int | None = None) -> SocialModel:
+    """
+    Region social model, built once per stored provisions version
+    """
+    provisions_version = await get_provisions_version(region_id, regional_scenario_id)
+    return await _fetch_social_model(region_id, regional_scenario_id, provisions_version)
+
+@cached(SOCIAL_MODELS_TTL, region_arg='region_id', cache=social_models_cache)
+async def _fetch_social_model(region_id : int, regional_scenario_id : int | None, provisions_version : tuple) -> SocialModel:
     #fetch service types
     logger.info(f'Fetching service types for {region_id}')
     service_types = await fetch_service_types(region_id)
@@ -167,11 +362,33 @@ async def fetch_social_model(region_id : int, regional_scenario_id : int | None
 
     #load provisions
     logger.info(f'Fetching indicators for {region_id}')
-    provisions = {st : await load(region_id, st.id, regional_scenario_id) for st in service_types.values()}
+    provisions = await load_many(region_id, list(service_types.keys()), regional_scenario_id)
+    missing_ids = set(service_types.keys()) - set(provisions.keys())
+    if len(missing_ids) > 0:
+        raise FileNotFoundError(f'Provisions of {sorted(missing_ids)} service types are not evaluated for {region_id}')
+    provisions = {service_types[st_id] : provision for st_id, provision in provisions.items()}
 
     #initialize social model
     logger.info('Initializing social model')
-    return SocialModel(towns_gdf, provisions)
+    return await compute.run(compute.SOCIAL_KIND, SocialModel, towns_gdf, provisions)
+
+async def _warm_social_model(region_id : int, regional_scenario_id : int | None = None):
+    try:
+        await fetch_social_model(region_id, regional_scenario_id)
+        logger.success(f'Social model of {region_id} is warmed up')
+    except Exception as e:
+        logger.error(f'Failed to warm up social model of {region_id}: {e}')
+
+def warm_social_model(region_id : int, regional_scenario_id : int | None = None):
+    """
+    Build region social model in the background so the first project evaluation does not wait for it
+    """
+    task = asyncio.create_task(_warm_social_model(region_id, regional_scenario_id))
+    _warmup_tasks.add(task)
+    task.add_done_callback(_warmup_tasks.discard)
+
+def invalidate_social_models(region_id : int | None = None) -> int:
+    return invalidate_region(region_id, social_models_cache)
 
 def _get_interpretation(evaluations_df : pd.DataFrame) -> str:
     evaluations_df = evaluations_df.sort_values('score', ascending=False)
@@ -213,6 +430,61 @@ def evaluate_social(social_model : SocialModel, project_geometry : Polygon | Mul
 
     return round(sum(categories_scores.values()),1), categories_scores, interpretation
 
+def _get_accessibility_meters(social_model : SocialModel, service_type : ServiceType) -> float:
+    if service_type.accessibility_type == AccessibilityType.METERS:
+        return service_type.accessibility_value
+    return service_type.accessibility_value * social_model.travel_speed
+
+def evaluate_social_batch(social_model : SocialModel, geometries : gpd.GeoSeries, interpretation : bool = False) -> pd.DataFrame:
+    """
+    Evaluate social scores of all geometries at once, scores are the same evaluate_social gives for each geometry.
+    Returns frame with score, categories scores and interpretation (optional) columns
+    """
+    service_types = list(social_model.provisions.keys())
+    crs = social_model.estimated_crs
+    towns_geometries = social_model.towns.to_crs(crs).geometry.values
+    geometries = geometries.to_crs(crs)
+    cells_geometries = geometries.values
+
+    # towns and geometries pairs within the largest accessibility radius matched by spatial index in one pass
+    radiuses = np.array([_get_accessibility_meters(social_model, st) for st in service_types], dtype=float)
+    towns_ids, cells_ids = geometries.sindex.query(towns_geometries, predicate='dwithin', distance=radiuses.max())
+    distances = shapely.distance(towns_geometries[towns_ids], cells_geometries[cells_ids])
+
+    # provisions of towns within each service type radius summed by geometries
+    cells_count = len(geometries)
+    provisions = np.full((cells_count, len(service_types)), np.nan)
+    for i, (st, radius) in enumerate(zip(service_types, radiuses)):
+        provision_df = social_model.provisions[st].reindex(social_model.towns.index, fill_value=0)
+        mask = distances <= radius
+        st_towns_ids = towns_ids[mask]
+        st_cells_ids = cells_ids[mask]
+        towns_count = np.bincount(st_cells_ids, minlength=cells_count)
+        demand_within = np.bincount(st_cells_ids, weights=provision_df['demand_within'].values[st_towns_ids].astype(float), minlength=cells_count)
+        demand = np.bincount(st_cells_ids, weights=provision_df['demand'].values[st_towns_ids].astype(float), minlength=cells_count)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            provisions[:, i] = np.where(towns_count > 0, demand_within / demand, np.nan)
+
+    # categories scores as weighted provisions sums relative to the max possible score
+    weights = np.array([st.weight for st in service_types], dtype=float)
+    scores = provisions * weights
+    result_df = pd.DataFrame(index=geometries.index)
+    for category in list(Category):
+        mask = np.array([st.category == category for st in service_types], dtype=bool)
+        max_possible_score = weights[mask].sum()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            category_scores = CATEGORIES_WEIGHTS[category] * np.nansum(scores[:, mask], axis=1) / max_possible_score
+        result_df[category] = [round(score, 1) for score in category_scores]
+    result_df['score'] = [round(score, 1) for score in result_df[list(Category)].sum(axis=1)]
+
+    if interpretation:
+        names = [st.name for st in service_types]
+        result_df['interpretation'] = [
+            _get_interpretation(pd.DataFrame({'name': names, 'score': cell_scores}))
+            for cell_scores in scores
+        ]
+    return result_df
+
 async def fetch_regional_scenario_id(project_scenario_id : int):
     return None # FIXME исправить когда появятся сценарии
 
@@ -228,16 +500,11 @@ async def _save_project_indicators(project_scenario_id : int, social_score : int
         SOCIAL_INDICATOR_ID : social_score,
         **{CATEGORIES_INDICATORS_IDS[category] : score for category, score in categories_scores.items()}
     }
-    for indicator_id, value in indicators_mapping.items():
-        try:
-            if indicator_id == SOCIAL_INDICATOR_ID:
-                res = await api_client.put_scenario_indicator(indicator_id, project_scenario_id, value, token, comment)
-            else:
-                res = await api_client.put_scenario_indicator(indicator_id, project_scenario_id, value, token)
-            logger.success(f'{indicator_id} -> {value}')
-        except Exception as e:
-            logger.error(f'{indicator_id} -> {value}')
-            logger.error(str(e))
+    payloads = [
+        api_client.get_scenario_indicator_payload(indicator_id, project_scenario_id, value, comment if indicator_id == SOCIAL_INDICATOR_ID else '-')
+        for indicator_id, value in indicators_mapping.items()
+    ]
+    await indicators_writer.write(lambda payload : api_client.put_scenario_indicator_value(payload, token), payloads)
     # logger.success(f'project_scenario #{project_scenario_id} -> {SOCIAL_INDICATOR_ID} : {social_score}')
     # for category, score in categories_scores.items():
     #     indicator_id = CATEGORIES_INDICATORS_IDS[category]
@@ -249,7 +516,7 @@ async def evaluate_and_save_project(region_id : int, project_scenario_id : int,
     project_geometry = await fetch_project_geometry(project_scenario_id, token)
     social_model = await fetch_social_model(region_id, regional_scenario_id)
     logger.info('Evaluating social score')
-    social_score, categories_scores, interpretation = evaluate_social(social_model, project_geometry)
+    social_score, categories_scores, interpretation = await compute.run(compute.SOCIAL_KIND, evaluate_social, social_model, project_geometry)
     logger.info('Saving indicators')
     await _save_project_indicators(project_scenario_id, social_score, categories_scores, interpretation, token)
 
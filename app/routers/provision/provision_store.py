@@ -0,0 +1,241 @@
+import os
+import json
+import re
+import shutil
+import threading
+import pandas as pd
+import geopandas as gpd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from loguru import logger
+from ...utils.cache import TTLCache
+from ...utils.const import DATA_PATH, PROVISIONS_CACHE_MAX_BYTES
+
+PROVISIONS_PATH = os.path.join(DATA_PATH, 'provisions')
+LEGACY_PATH = os.path.join(DATA_PATH, 'legacy')
+LEGACY_FILE_PATTERN = re.compile(r'^(\d+)_(\d+)(?:_(\d+))?\.parquet$')
+
+TOWNS_FILE = 'towns.parquet'
+UNITS_FILE = 'units.parquet'
+SERVICE_TYPES_DIR = 'service_types'
+LEVELS_DIR = 'levels'
+LEVEL_PARTITION_COLUMN = 'level'
+LAYERS_DIR = 'layers'
+LAYER_PARTITION_COLUMN = 'layer'
+SERVICE_TYPES_IDS_METADATA = b'service_types_ids'
+PARTITION_COLUMN = 'service_type_id'
+INDEX_COLUMN = 'territory_id'
+PART_FILE = 'part-0.parquet'
+
+# files are immutable once written, entries live until evicted or replaced by a newer file version
+frames_cache = TTLCache(PROVISIONS_CACHE_MAX_BYTES)
+FRAMES_CACHE_TTL = float('inf')
+_files_versions : dict[str, tuple[int, int]] = {}
+# store functions are run in threads, while the cache itself is not thread safe
+_frames_lock = threading.Lock()
+# writers rewrite the shared geometry file through the same tmp path
+_write_lock = threading.Lock()
+
+def _get_store_path(region_id : int, regional_scenario_id : int | None = None) -> str:
+    dir_name = f'{region_id}'
+    if regional_scenario_id is not None:
+        dir_name = f'{dir_name}_{regional_scenario_id}'
+    return os.path.join(PROVISIONS_PATH, dir_name)
+
+def _get_level_path(region_id : int, regional_scenario_id : int | None = None, level : int | None = None) -> str:
+    # town level provisions are kept in the store root, units aggregations under levels/level=L
+    store_path = _get_store_path(region_id, regional_scenario_id)
+    if level is None:
+        return store_path
+    return os.path.join(store_path, LEVELS_DIR, f'{LEVEL_PARTITION_COLUMN}={level}')
+
+def _get_geometry_path(region_id : int, regional_scenario_id : int | None = None, level : int | None = None) -> str:
+    return os.path.join(_get_level_path(region_id, regional_scenario_id, level), TOWNS_FILE if level is None else UNITS_FILE)
+
+def _get_partition_path(region_id : int, service_type_id : int, regional_scenario_id : int | None = None, level : int | None = None) -> str:
+    level_path = _get_level_path(region_id, regional_scenario_id, level)
+    return os.path.join(level_path, SERVICE_TYPES_DIR, f'{PARTITION_COLUMN}={service_type_id}', PART_FILE)
+
+def _get_layer_path(region_id : int, layer : str, regional_scenario_id : int | None = None) -> str:
+    store_path = _get_store_path(region_id, regional_scenario_id)
+    return os.path.join(store_path, LAYERS_DIR, f'{LAYER_PARTITION_COLUMN}={layer}', PART_FILE)
+
+def _replace(write, path : str):
+    # written aside and swapped so readers never see a partial file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+def get_service_types_ids(region_id : int, regional_scenario_id : int | None = None, level : int | None = None) -> list[int]:
+    service_types_path = os.path.join(_get_level_path(region_id, regional_scenario_id, level), SERVICE_TYPES_DIR)
+    if not os.path.exists(service_types_path):
+        return []
+    return [int(dir_name.split('=')[1]) for dir_name in os.listdir(service_types_path) if os.path.exists(os.path.join(service_types_path, dir_name, PART_FILE))]
+
+def get_levels(region_id : int, regional_scenario_id : int | None = None) -> list[int]:
+    """
+    Levels having stored units aggregations
+    """
+    levels_path = os.path.join(_get_store_path(region_id, regional_scenario_id), LEVELS_DIR)
+    if not os.path.exists(levels_path):
+        return []
+    return sorted(int(dir_name.split('=')[1]) for dir_name in os.listdir(levels_path))
+
+def exists(region_id : int, service_type_id : int, regional_scenario_id : int | None = None, level : int | None = None) -> bool:
+    return os.path.exists(_get_partition_path(region_id, service_type_id, regional_scenario_id, level))
+
+def get_version(region_id : int, regional_scenario_id : int | None = None, layer : str | None = None) -> tuple[int, int]:
+    """
+    Count and latest modification time of the town level partitions and the layer, changed by any worker rewriting them
+    """
+    paths = [_get_partition_path(region_id, st_id, regional_scenario_id) for st_id in get_service_types_ids(region_id, regional_scenario_id)]
+    if layer is not None and layer_exists(region_id, layer, regional_scenario_id):
+        paths.append(_get_layer_path(region_id, layer, regional_scenario_id))
+    mtimes = []
+    for path in paths:
+        try:
+            mtimes.append(os.stat(path).st_mtime_ns)
+        except FileNotFoundError:
+            # removed by another worker meanwhile
+            continue
+    return len(mtimes), max(mtimes, default=0)
+
+def _read_cached(path : str, read, columns : list[str] | None = None):
+    """
+    Read the file through the frames cache keyed by path, mtime and size, so rewritten files are picked up
+    """
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    key = (path, version, None if columns is None else tuple(columns))
+    with _frames_lock:
+        frame = frames_cache.get(key)
+    if frame is None:
+        frame = read(path, columns)
+        with _frames_lock:
+            # older versions of the file are of no use anymore
+            if _files_versions.get(path) != version:
+                frames_cache.invalidate(path)
+                _files_versions[path] = version
+            frames_cache.set(key, frame, FRAMES_CACHE_TTL, tags={path})
+    return frame
+
+def _read_geometry(path : str, columns : list[str] | None = None) -> gpd.GeoDataFrame:
+    # hive style directories names should not turn into columns
+    return gpd.read_parquet(path, columns=columns, partitioning=None)
+
+def _load_geometry(region_id : int, regional_scenario_id : int | None = None, level : int | None = None) -> gpd.GeoDataFrame:
+    geometry_path = _get_geometry_path(region_id, regional_scenario_id, level)
+    return _read_cached(geometry_path, _read_geometry)
+
+def _save_geometry(gdf : gpd.GeoDataFrame, region_id : int, regional_scenario_id : int | None = None, level : int | None = None):
+    geometry_path = _get_geometry_path(region_id, regional_scenario_id, level)
+    # territories missing in the stored geometry are appended, so older service types keep their territories
+    if os.path.exists(geometry_path):
+        stored_gdf = _read_geometry(geometry_path)
+        new_gdf = gdf[~gdf.index.isin(stored_gdf.index)]
+        if len(new_gdf) == 0:
+            return
+        gdf = pd.concat([stored_gdf, new_gdf])
+    gdf = gdf[['geometry']].copy()
+    gdf.index.name = INDEX_COLUMN
+    _replace(gdf.to_parquet, geometry_path)
+
+def _delete_aggregations(region_id : int, service_type_id : int, regional_scenario_id : int | None = None):
+    for level in get_levels(region_id, regional_scenario_id):
+        partition_path = _get_partition_path(region_id, service_type_id, regional_scenario_id, level)
+        if os.path.exists(partition_path):
+            os.remove(partition_path)
+
+def save(provision_gdf : gpd.GeoDataFrame, region_id : int, service_type_id : int, regional_scenario_id : int | None = None, level : int | None = None):
+    """
+    Save town level provision or its aggregation by units of the level
+    """
+    provision_df = pd.DataFrame(provision_gdf.drop(columns='geometry'))
+    provision_df.index.name = INDEX_COLUMN
+    table = pa.Table.from_pandas(provision_df.reset_index(), preserve_index=False)
+    with _write_lock:
+        _save_geometry(provision_gdf, region_id, regional_scenario_id, level)
+        _replace(lambda path : pq.write_table(table, path), _get_partition_path(region_id, service_type_id, regional_scenario_id, level))
+        # aggregations of the previous town level provision are outdated now
+        if level is None:
+            _delete_aggregations(region_id, service_type_id, regional_scenario_id)
+
+def _read_partition(path : str, columns : list[str] | None = None) -> pd.DataFrame:
+    return pq.read_table(path, columns=columns, partitioning=None).to_pandas().set_index(INDEX_COLUMN)
+
+def load_many(region_id : int, service_types_ids : list[int], regional_scenario_id : int | None = None, columns : list[str] | None = None, level : int | None = None) -> dict[int, gpd.GeoDataFrame]:
+    """
+    Read only requested service types partitions (and columns) and attach the shared towns or level units geometry read once
+    """
+    partitions_paths = {st_id : _get_partition_path(region_id, st_id, regional_scenario_id, level) for st_id in service_types_ids}
+    partitions_paths = {st_id : path for st_id, path in partitions_paths.items() if os.path.exists(path)}
+    if len(partitions_paths) == 0:
+        return {}
+    if columns is not None:
+        columns = [INDEX_COLUMN, *[c for c in columns if c != INDEX_COLUMN]]
+    geometry_gdf = _load_geometry(region_id, regional_scenario_id, level)
+    provisions = {}
+    for service_type_id, path in partitions_paths.items():
+        provision_df = _read_cached(path, _read_partition, columns)
+        provisions[service_type_id] = geometry_gdf.loc[provision_df.index].join(provision_df)
+    return provisions
+
+def load(region_id : int, service_type_id : int, regional_scenario_id : int | None = None, columns : list[str] | None = None) -> gpd.GeoDataFrame:
+    provisions = load_many(region_id, [service_type_id], regional_scenario_id, columns)
+    if service_type_id not in provisions:
+        raise FileNotFoundError(_get_partition_path(region_id, service_type_id, regional_scenario_id))
+    return provisions[service_type_id]
+
+def layer_exists(region_id : int, layer : str, regional_scenario_id : int | None = None) -> bool:
+    return os.path.exists(_get_layer_path(region_id, layer, regional_scenario_id))
+
+def save_layer(layer_gdf : gpd.GeoDataFrame, region_id : int, layer : str, service_types_ids : list[int], regional_scenario_id : int | None = None):
+    """
+    Save merged layer columns, service types it was built from are kept in the file metadata
+    """
+    layer_df = pd.DataFrame(layer_gdf.drop(columns='geometry'))
+    layer_df.index.name = INDEX_COLUMN
+    table = pa.Table.from_pandas(layer_df.reset_index(), preserve_index=False)
+    metadata = {**(table.schema.metadata or {}), SERVICE_TYPES_IDS_METADATA: json.dumps(service_types_ids).encode()}
+    table = table.replace_schema_metadata(metadata)
+    with _write_lock:
+        _save_geometry(layer_gdf, region_id, regional_scenario_id)
+        _replace(lambda path : pq.write_table(table, path), _get_layer_path(region_id, layer, regional_scenario_id))
+
+def _read_layer(path : str, columns : list[str] | None = None) -> tuple[pd.DataFrame, list[int]]:
+    table = pq.read_table(path, columns=columns, partitioning=None)
+    service_types_ids = json.loads(table.schema.metadata[SERVICE_TYPES_IDS_METADATA])
+    return table.to_pandas().set_index(INDEX_COLUMN), service_types_ids
+
+def load_layer(region_id : int, layer : str, regional_scenario_id : int | None = None) -> tuple[gpd.GeoDataFrame, list[int]] | None:
+    layer_path = _get_layer_path(region_id, layer, regional_scenario_id)
+    if not os.path.exists(layer_path):
+        return None
+    layer_df, service_types_ids = _read_cached(layer_path, _read_layer)
+    towns_gdf = _load_geometry(region_id, regional_scenario_id)
+    return towns_gdf.loc[layer_df.index].join(layer_df), service_types_ids
+
+def migrate():
+    """
+    Move legacy {region}_{service_type}[_{scenario}].parquet files from DATA_PATH into the store
+    """
+    if not os.path.exists(DATA_PATH):
+        return
+    for file_name in sorted(os.listdir(DATA_PATH)):
+        match = LEGACY_FILE_PATTERN.match(file_name)
+        if match is None:
+            continue
+        region_id, service_type_id, regional_scenario_id = match.groups()
+        region_id = int(region_id)
+        service_type_id = int(service_type_id)
+        regional_scenario_id = None if regional_scenario_id is None else int(regional_scenario_id)
+        file_path = os.path.join(DATA_PATH, file_name)
+        try:
+            if not exists(region_id, service_type_id, regional_scenario_id):
+                save(gpd.read_parquet(file_path), region_id, service_type_id, regional_scenario_id)
+            os.makedirs(LEGACY_PATH, exist_ok=True)
+            shutil.move(file_path, os.path.join(LEGACY_PATH, file_name))
+            logger.info(f'Migrated {file_name} into the provisions store')
+        except Exception as e:
+            logger.error(f'Failed to migrate {file_name}: {e}')
@@ -0,0 +1,19 @@
+import pandas as pd
+import geopandas as gpd
+from townsnet.provision.service_type import ServiceType
+from townsnet.provision.provision_model import ProvisionModel
+from ...utils import matrix_store
+
+# initialized once per pool process, so tasks carry only supplies and service type
+_provision_model : ProvisionModel | None = None
+
+def initialize(towns_gdf : gpd.GeoDataFrame, region_id : int, regional_scenario_id : int | None = None):
+    """
+    Pool initializer, maps the stored accessibility matrix so every process shares the same memory pages
+    """
+    global _provision_model
+    acc_mx = matrix_store.load(region_id, regional_scenario_id=regional_scenario_id)
+    _provision_model = ProvisionModel(towns_gdf, matrix_store.NoCopyMatrix(acc_mx), verbose = False)
+
+def calculate(supplies_df : pd.DataFrame, service_type : ServiceType) -> gpd.GeoDataFrame:
+    return _provision_model.calculate(supplies_df, service_type)
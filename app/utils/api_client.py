@@ -1,55 +1,83 @@
 import os
+import math
+import asyncio
 import shapely
-import json
-import requests_async as ra
+import numpy as np
 import pandas as pd
 import geopandas as gpd
 from datetime import date
+from . import http_client, metrics
+from .cache import cached
 from .const import URBAN_API, TRANSPORT_FRAMES_API, DEFAULT_CRS
 
 PAGE_SIZE = 10_000
+PAGES_CONCURRENCY = 4
 POPULATION_COUNT_INDICATOR_ID = 1
 GRAPH_TYPE = 'inter'
 INDICATOR_VALUE_TYPE = 'real'
 INDICATOR_INFORMATION_SOURCE = 'townsnet'
 
-async def get_accessibility_matrix(region_id : int):
-    res = await ra.get(f'{TRANSPORT_FRAMES_API}/{region_id}/get_matrix', {
-        'graph_type': GRAPH_TYPE
-    }, verify=False)
+# reference data TTLs in seconds
+REGIONS_TTL = 24 * 60 * 60
+TERRITORIES_TTL = 6 * 60 * 60
+SERVICE_TYPES_TTL = 6 * 60 * 60
+NORMATIVES_TTL = 6 * 60 * 60
+PHYSICAL_OBJECTS_TYPES_TTL = 24 * 60 * 60
+INDICATORS_TTL = 24 * 60 * 60
+
+@metrics.upstream_call
+async def get_accessibility_matrix(region_id : int, graph_type : str = GRAPH_TYPE):
+    res = await http_client.get(f'{TRANSPORT_FRAMES_API}/{region_id}/get_matrix', {
+        'graph_type': graph_type
+    })
+    res.raise_for_status()
     res_json = res.json()
-    return pd.DataFrame(res_json['values'], index=res_json['index'], columns=res_json['columns'])
+    values = np.asarray(res_json['values'], dtype=np.float32)
+    return pd.DataFrame(values, index=res_json['index'], columns=res_json['columns'], copy=False)
 
 async def _get_physical_objects(region_id : int, pot_id : int, page : int, page_size : int = PAGE_SIZE):
-    res = await ra.get(f'{URBAN_API}/api/v1/territory/{region_id}/physical_objects_with_geometry', {
+    res = await http_client.get(f'{URBAN_API}/api/v1/territory/{region_id}/physical_objects_with_geometry', {
         'physical_object_type_id': pot_id,
         'page': page,
         'page_size': page_size,
-    }, verify=False)
+    })
+    res.raise_for_status()
     return res.json()
 
-async def get_physical_objects(region_id : int, pot_id : int) -> gpd.GeoDataFrame | None:
-    page = 1
-    results = []
-    while True:
-        res_json = await _get_physical_objects(region_id, pot_id, page, page_size=PAGE_SIZE)
-        results.extend(res_json['results'])
-        if res_json['next'] is None:
-            break
-        page += 1
+@metrics.upstream_call
+async def get_physical_objects(region_id : int, pot_id : int, concurrent : bool = True) -> gpd.GeoDataFrame | None:
+    res_json = await _get_physical_objects(region_id, pot_id, 1, page_size=PAGE_SIZE)
+    results = res_json['results']
+    if res_json['next'] is not None:
+        if concurrent and 'count' in res_json:
+            #fetching the rest pages with bounded fan-out
+            pages_count = math.ceil(res_json['count'] / PAGE_SIZE)
+            semaphore = asyncio.Semaphore(PAGES_CONCURRENCY)
+            async def _get_page(page : int):
+                async with semaphore:
+                    return await _get_physical_objects(region_id, pot_id, page, page_size=PAGE_SIZE)
+            pages_jsons = await asyncio.gather(*[_get_page(page) for page in range(2, pages_count + 1)])
+            for page_json in pages_jsons:
+                results.extend(page_json['results'])
+        else:
+            page = 1
+            while res_json['next'] is not None:
+                page += 1
+                res_json = await _get_physical_objects(region_id, pot_id, page, page_size=PAGE_SIZE)
+                results.extend(res_json['results'])
     #recovering geometries
-    for result in results:
-        g = result['geometry']
-        result['geometry'] = shapely.from_geojson(json.dumps(g))
+    results = [result for result in results if result.get('geometry') is not None]
     if len(results) > 0:
-        return gpd.GeoDataFrame(results, crs=DEFAULT_CRS).set_index('physical_object_id')
+        geometries = [shapely.geometry.shape(result.pop('geometry')) for result in results]
+        return gpd.GeoDataFrame(results, geometry=geometries, crs=DEFAULT_CRS).set_index('physical_object_id')
     return None
 
-async def get_territories(parent_id : int | None = None, all_levels = False, geometry : bool = False) -> pd.DataFrame | gpd.GeoDataFrame:
-    res = await ra.get(URBAN_API + f'/api/v1/all_territories{"" if geometry else "_without_geometry"}', {
+async def _get_territories(parent_id : int | None = None, all_levels = False, geometry : bool = False) -> pd.DataFrame | gpd.GeoDataFrame:
+    res = await http_client.get(URBAN_API + f'/api/v1/all_territories{"" if geometry else "_without_geometry"}', {
         'parent_id': parent_id,
         'get_all_levels': all_levels
-    }, verify=False)
+    })
+    res.raise_for_status()
     res_json = res.json()
     if geometry:
         gdf = gpd.GeoDataFrame.from_features(res_json, crs=DEFAULT_CRS)
@@ -57,8 +85,14 @@ async def get_territories(parent_id : int | None = None, all_levels = False, geo
     df = pd.DataFrame(res_json)
     return df.set_index('territory_id', drop=True)
 
+@cached(TERRITORIES_TTL, region_arg='parent_id')
+@metrics.upstream_call
+async def get_territories(parent_id : int | None = None, all_levels = False, geometry : bool = False) -> pd.DataFrame | gpd.GeoDataFrame:
+    return await _get_territories(parent_id, all_levels, geometry)
+
+@metrics.upstream_call
 async def get_territories_population(territories_gdf : gpd.GeoDataFrame):
-    res = await ra.get(f'{URBAN_API}/api/v1/indicator/{POPULATION_COUNT_INDICATOR_ID}/values', verify=False)
+    res = await http_client.get(f'{URBAN_API}/api/v1/indicator/{POPULATION_COUNT_INDICATOR_ID}/values')
     res_df = pd.DataFrame(res.json())
     res_df = res_df[res_df['territory'].apply(lambda x: x['id'] if isinstance(x, dict) else None).isin(territories_gdf.index)]
     res_df = (
@@ -69,56 +103,105 @@ async def get_territories_population(territories_gdf : gpd.GeoDataFrame):
     )
     return territories_gdf[['geometry', 'name']].merge(res_df, left_index=True, right_index=True)
 
+@metrics.upstream_call
 async def get_service_type_capacities(territory_id : int, level : int, service_type_id : int) -> list[dict[str, int]]:
-    res = await ra.get(URBAN_API + f'/api/v1/territory/{territory_id}/services_capacity', {
+    res = await http_client.get(URBAN_API + f'/api/v1/territory/{territory_id}/services_capacity', {
         'level': level,
         'service_type_id': service_type_id
-    }, verify=False)
+    })
     return res.json()
 
+@cached(REGIONS_TTL, all_regions=True)
+@metrics.upstream_call
 async def get_regions(geometry : bool = False) -> gpd.GeoDataFrame:
-    countries = await get_territories()
+    countries = await _get_territories()
     countries_ids = countries.index
-    countries_regions = [await get_territories(country_id, geometry=geometry) for country_id in countries_ids]
+    countries_regions = await asyncio.gather(*[_get_territories(country_id, geometry=geometry) for country_id in countries_ids])
     return pd.concat(countries_regions)
 
+@cached(SERVICE_TYPES_TTL, region_arg='territory_id')
+@metrics.upstream_call
 async def get_service_types(territory_id : int) -> list[dict]:
-    res = await ra.get(URBAN_API + f'/api/v1/territory/{territory_id}/service_types', verify=False)
+    res = await http_client.get(URBAN_API + f'/api/v1/territory/{territory_id}/service_types')
+    res.raise_for_status()
     return res.json()
 
+@cached(NORMATIVES_TTL, region_arg='territory_id')
+@metrics.upstream_call
 async def get_normatives(territory_id : int) -> list[dict]:
-    res = await ra.get(URBAN_API + f'/api/v1/territory/{territory_id}/normatives', params={'year':2024}, verify=False)
+    res = await http_client.get(URBAN_API + f'/api/v1/territory/{territory_id}/normatives', {'year':2024})
+    res.raise_for_status()
     return res.json()
 
+@cached(PHYSICAL_OBJECTS_TYPES_TTL, all_regions=True)
+@metrics.upstream_call
 async def get_physical_objects_types() -> list[dict]:
-    res = await ra.get(URBAN_API + '/api/v1/physical_object_types', verify=False)
+    res = await http_client.get(URBAN_API + '/api/v1/physical_object_types')
+    res.raise_for_status()
     return res.json()
 
+@cached(INDICATORS_TTL, all_regions=True)
+@metrics.upstream_call
 async def get_indicators():
-    res = await ra.get(URBAN_API + '/api/v1/indicators_by_parent', {'get_all_subtree':True}, verify=False)
+    res = await http_client.get(URBAN_API + '/api/v1/indicators_by_parent', {'get_all_subtree':True})
+    res.raise_for_status()
     return res.json()
 
+@metrics.upstream_call
 async def get_scenario_by_id(scenario_id : int, token : str):
-    res = await ra.get(URBAN_API + f'/api/v1/scenarios/{scenario_id}', headers={'Authorization': f'Bearer {token}'}, verify=False)
+    res = await http_client.get(URBAN_API + f'/api/v1/scenarios/{scenario_id}', headers={'Authorization': f'Bearer {token}'})
+    res.raise_for_status()
     return res.json()
 
+@metrics.upstream_call
 async def get_project_by_id(project_id : int, token : str):
-    res = await ra.get(URBAN_API + f'/api/v1/projects/{project_id}/territory', headers={'Authorization': f'Bearer {token}'}, verify=False)
+    res = await http_client.get(URBAN_API + f'/api/v1/projects/{project_id}/territory', headers={'Authorization': f'Bearer {token}'})
+    res.raise_for_status()
     return res.json()
 
-async def put_scenario_indicator(indicator_id : int, scenario_id : int, value : float, token : str, comment : str = '-'):
-    res = await ra.put(URBAN_API + f'/api/v1/scenarios/indicators_values', headers={'Authorization': f'Bearer {token}'}, json={
+def get_scenario_indicator_payload(indicator_id : int, scenario_id : int, value : float, comment : str = '-', information_source : str = INDICATOR_INFORMATION_SOURCE, properties : dict | None = None) -> dict:
+    return {
         "indicator_id": indicator_id,
         "scenario_id": scenario_id,
         "territory_id": None,
         "hexagon_id": None,
         "value": value,
         "comment": comment,
-        "information_source": INDICATOR_INFORMATION_SOURCE,
-        "properties": {}
-    }, verify=False)
+        "information_source": information_source,
+        "properties": properties or {}
+    }
+
+def get_indicators_values_payloads(values_df : pd.DataFrame, date_value : str, information_source : str = INDICATOR_INFORMATION_SOURCE, date_type : str = 'day', value_type : str = INDICATOR_VALUE_TYPE) -> list[dict]:
+    """
+    Territories indicators values payloads from the frame indexed by territory_id with indicators ids columns
+    """
+    values_df = values_df.copy()
+    values_df.index.name = 'territory_id'
+    values_df.columns.name = 'indicator_id'
+    payloads_df = values_df.stack().rename('value').reset_index()
+    payloads_df['date_type'] = date_type
+    payloads_df['date_value'] = date_value
+    payloads_df['value_type'] = value_type
+    payloads_df['information_source'] = information_source
+    return payloads_df.to_dict('records')
+
+@metrics.upstream_call
+async def put_scenario_indicator_value(payload : dict, token : str):
+    res = await http_client.put(URBAN_API + f'/api/v1/scenarios/indicators_values', headers={'Authorization': f'Bearer {token}'}, json=payload)
+    res.raise_for_status()
+    return res
+
+@metrics.upstream_call
+async def put_scenario_indicator(indicator_id : int, scenario_id : int, value : float, token : str, comment : str = '-', information_source : str = INDICATOR_INFORMATION_SOURCE, properties : dict | None = None):
+    payload = get_scenario_indicator_payload(indicator_id, scenario_id, value, comment, information_source, properties)
+    return await put_scenario_indicator_value(payload, token)
+
+@metrics.upstream_call
+async def put_indicator_value(payload : dict):
+    res = await http_client.put(URBAN_API + '/api/v1/indicator_value', json=payload)
     res.raise_for_status()
     return res
 
+@metrics.upstream_call
 async def post_territory_indicator(indicator_id : int, territory_id : int, value : float):
     ...
@@ -0,0 +1,223 @@
+import asyncio
+import fcntl
+import inspect
+import json
+import os
+import sys
+import time
+import uuid
+import shapely
+import pandas as pd
+import geopandas as gpd
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import wraps
+from typing import Any, Callable, Hashable, Iterable
+from .const import CACHE_MAX_BYTES, DATA_PATH
+
+REGION_TAG = 'region'
+ALL_REGIONS = 'all'
+INVALIDATIONS_PATH = os.path.join(DATA_PATH, 'cache', 'invalidations.json')
+
+# invalidation markers already applied by this worker
+_seen_invalidations : dict[str, str] = {}
+
+def get_size(value : Any) -> int:
+    """
+    Rough estimation of the value memory footprint in bytes
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        size = value.memory_usage(deep=True)
+        size = int(size.sum()) if isinstance(size, pd.Series) else int(size)
+        # geometries are counted as pointers by pandas, coordinates are added on top
+        if isinstance(value, gpd.GeoDataFrame):
+            for column in value.columns[value.dtypes == 'geometry']:
+                size += int(shapely.get_num_coordinates(value[column].values).sum()) * 16
+        return size
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(get_size(k) + get_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return sys.getsizeof(value) + sum(get_size(v) for v in value)
+    if hasattr(value, '__dict__'):
+        return sys.getsizeof(value) + get_size(vars(value))
+    return sys.getsizeof(value)
+
+def _copy(value : Any) -> Any:
+    # shallow copies protect cached values from callers adding columns or items
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return value.copy(deep=False)
+    if isinstance(value, (list, dict)):
+        return value.copy()
+    return value
+
+@dataclass
+class _Entry:
+    value : Any
+    expires_at : float
+    size : int
+    tags : frozenset = field(default_factory=frozenset)
+
+class TTLCache():
+    """
+    Memory bounded LRU cache with per-entry TTL, tags and single-flight loading
+    """
+
+    def __init__(self, max_bytes : int = CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries : OrderedDict[Hashable, _Entry] = OrderedDict()
+        self._pending : dict[tuple[asyncio.AbstractEventLoop, Hashable], asyncio.Task] = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._generation = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key : Hashable):
+        entry = self._entries.get(key)
+        return entry is not None and entry.expires_at > time.monotonic()
+
+    def get(self, key : Hashable, default : Any = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is None or entry.expires_at <= time.monotonic():
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry.value
+
+    def set(self, key : Hashable, value : Any, ttl : float, tags : Iterable | None = None, size : int | None = None):
+        if key in self._entries:
+            self._remove(key)
+        size = get_size(value) if size is None else size
+        if size > self.max_bytes:
+            return
+        self._entries[key] = _Entry(value, time.monotonic() + ttl, size, frozenset(tags or []))
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def _remove(self, key : Hashable):
+        entry = self._entries.pop(key)
+        self.bytes -= entry.size
+
+    def invalidate(self, tag : Hashable | None = None) -> int:
+        """
+        Remove entries with the tag or all entries if tag is None, returns removed entries count
+        """
+        # loads started before invalidation should not put stale values back
+        self._generation += 1
+        keys = [key for key, entry in self._entries.items() if tag is None or tag in entry.tags]
+        for key in keys:
+            self._remove(key)
+        return len(keys)
+
+    async def get_or_set(self, key : Hashable, factory : Callable, ttl : float, tags : Iterable | None = None) -> Any:
+        """
+        Return cached value or load it with the factory coroutine. Concurrent misses of the same key share a single load
+        """
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at > time.monotonic():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.value
+        self.misses += 1
+        pending_key = (asyncio.get_running_loop(), key)
+        task = self._pending.get(pending_key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._pending[pending_key] = task
+            generation = self._generation
+
+            def _on_done(task : asyncio.Task):
+                self._pending.pop(pending_key, None)
+                if not task.cancelled() and task.exception() is None and generation == self._generation:
+                    self.set(key, task.result(), ttl, tags)
+
+            task.add_done_callback(_on_done)
+        return await asyncio.shield(task)
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {
+            'entries': len(self._entries),
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+reference_cache = TTLCache()
+
+def cached(ttl : float, region_arg : str | None = None, all_regions : bool = False, cache : TTLCache = reference_cache):
+    """
+    Cache async function results by its arguments. Entries are tagged with the region from region_arg argument,
+    entries concerning every region (all_regions or region_arg being None) are dropped on any region invalidation
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = (func.__module__, func.__qualname__, tuple(bound.arguments.items()))
+            tags = set()
+            if region_arg is not None:
+                region_id = bound.arguments[region_arg]
+                tags.add((REGION_TAG, ALL_REGIONS if region_id is None else region_id))
+            if all_regions:
+                tags.add((REGION_TAG, ALL_REGIONS))
+            value = await cache.get_or_set(key, lambda : func(*args, **kwargs), ttl, tags)
+            return _copy(value)
+
+        wrapper.cache = cache
+        return wrapper
+    return decorator
+
+def invalidate_region(region_id : int | None = None, cache : TTLCache = reference_cache) -> int:
+    """
+    Invalidate cached entries of the region or the whole cache if region_id is None
+    """
+    if region_id is None:
+        return cache.invalidate()
+    return cache.invalidate((REGION_TAG, region_id)) + cache.invalidate((REGION_TAG, ALL_REGIONS))
+
+def _read_invalidations() -> dict[str, str]:
+    if not os.path.exists(INVALIDATIONS_PATH):
+        return {}
+    with open(INVALIDATIONS_PATH) as f:
+        return json.load(f)
+
+def mark_invalidated(region_id : int | None = None):
+    """
+    Record the region (or all regions if None) invalidation for the other workers of the deployment
+    """
+    os.makedirs(os.path.dirname(INVALIDATIONS_PATH), exist_ok=True)
+    key = ALL_REGIONS if region_id is None else str(region_id)
+    with open(f'{INVALIDATIONS_PATH}.lock', 'a') as lock_file:
+        # workers may invalidate different regions at once, markers are merged under the lock
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        invalidations = _read_invalidations()
+        invalidations[key] = uuid.uuid4().hex
+        tmp_path = f'{INVALIDATIONS_PATH}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(invalidations, f)
+        os.replace(tmp_path, INVALIDATIONS_PATH)
+    _seen_invalidations[key] = invalidations[key]
+
+def pop_invalidations() -> list[int | None]:
+    """
+    Regions invalidated by other workers since the last call, None stands for all regions
+    """
+    invalidations = _read_invalidations()
+    keys = [key for key, marker in invalidations.items() if _seen_invalidations.get(key) != marker]
+    _seen_invalidations.update({key : invalidations[key] for key in keys})
+    return [None if key == ALL_REGIONS else int(key) for key in keys]
@@ -0,0 +1,105 @@
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, asdict
+from functools import partial
+from typing import Any, Callable
+from .const import COMPUTE_EXECUTOR, COMPUTE_WORKERS, COMPUTE_KIND_LIMIT
+
+PROVISION_KIND = 'provision'
+SOCIAL_KIND = 'social'
+ENGINEERING_KIND = 'engineering'
+HEX_KIND = 'hex'
+TILES_KIND = 'tiles'
+
+# tiles are cheap and requested in bursts by map clients, so they get more slots
+KINDS_LIMITS = {
+    PROVISION_KIND : COMPUTE_KIND_LIMIT,
+    SOCIAL_KIND : COMPUTE_KIND_LIMIT,
+    ENGINEERING_KIND : COMPUTE_KIND_LIMIT,
+    HEX_KIND : COMPUTE_KIND_LIMIT,
+    TILES_KIND : COMPUTE_KIND_LIMIT * 2,
+}
+
+# the other kinds are called with region models and layers (the provision model holds the whole accessibility matrix),
+# pickling them to a process on every call costs more than the call itself, so they always run in threads
+PROCESS_KINDS = {HEX_KIND}
+
+_executors : dict[str, Executor] = {}
+_kinds_semaphores : dict[tuple[asyncio.AbstractEventLoop, str], asyncio.Semaphore] = {}
+
+@dataclass
+class KindStats:
+    pending : int = 0
+    completed : int = 0
+    failed : int = 0
+    queue_time : float = 0
+    max_queue_time : float = 0
+    run_time : float = 0
+
+_kinds_stats : dict[str, KindStats] = {}
+
+def _get_executor_type(kind : str) -> str:
+    if COMPUTE_EXECUTOR == 'process' and kind in PROCESS_KINDS:
+        return 'process'
+    return 'thread'
+
+def _create_executor(executor_type : str) -> Executor:
+    if executor_type == 'process':
+        # arguments are pickled to the workers, so it pays off for small inputs and long calls only
+        return ProcessPoolExecutor(max_workers=COMPUTE_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return ThreadPoolExecutor(max_workers=COMPUTE_WORKERS, thread_name_prefix='compute')
+
+def get_executor(kind : str) -> Executor:
+    executor_type = _get_executor_type(kind)
+    if executor_type not in _executors:
+        _executors[executor_type] = _create_executor(executor_type)
+    return _executors[executor_type]
+
+def shutdown():
+    """
+    Shut the executors down without waiting for the running calls, should be called once in the app lifespan
+    """
+    for executor in _executors.values():
+        executor.shutdown(wait=False, cancel_futures=True)
+    _executors.clear()
+
+def _get_kind_semaphore(kind : str) -> asyncio.Semaphore:
+    key = (asyncio.get_running_loop(), kind)
+    if key not in _kinds_semaphores:
+        _kinds_semaphores[key] = asyncio.Semaphore(KINDS_LIMITS.get(kind, COMPUTE_KIND_LIMIT))
+    return _kinds_semaphores[key]
+
+def _timed(func : Callable, *args, **kwargs) -> tuple[float, Any]:
+    # start is taken in the worker, so time spent in the executor queue is counted as waiting
+    started_at = time.time()
+    return started_at, func(*args, **kwargs)
+
+async def run(kind : str, func : Callable, *args, **kwargs) -> Any:
+    """
+    Run CPU-bound call in the compute executor, no more than kind limit calls of the same kind at once
+    """
+    stats = _kinds_stats.setdefault(kind, KindStats())
+    submitted_at = time.time()
+    stats.pending += 1
+    try:
+        async with _get_kind_semaphore(kind):
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(get_executor(kind), partial(_timed, func, *args, **kwargs))
+            started_at, result = await future
+    except Exception:
+        stats.failed += 1
+        raise
+    finally:
+        stats.pending -= 1
+    finished_at = time.time()
+    queue_time = max(started_at - submitted_at, 0)
+    stats.completed += 1
+    stats.queue_time += queue_time
+    stats.max_queue_time = max(stats.max_queue_time, queue_time)
+    stats.run_time += finished_at - started_at
+    return result
+
+def get_stats() -> dict[str, dict[str, float]]:
+    return {kind : asdict(stats) for kind, stats in _kinds_stats.items()}
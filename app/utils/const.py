@@ -15,5 +15,40 @@ if 'DATA_PATH' in os.environ:
 else:
     raise Exception('DATA_PATH not found in env variables')
 
+# set by the image build, warmups completed by the same version are not repeated on restarts
+APP_VERSION = os.environ.get('APP_VERSION') or 'dev'
+
 EVALUATION_RESPONSE_MESSAGE = 'Evaluation started'
 DEFAULT_CRS = 4326
+
+HTTP_MAX_CONNECTIONS = int(os.environ.get('HTTP_MAX_CONNECTIONS', 100))
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.environ.get('HTTP_MAX_CONNECTIONS_PER_HOST', 20))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 10))
+HTTP_TIMEOUT = float(os.environ.get('HTTP_TIMEOUT', 300))
+
+CACHE_MAX_BYTES = int(os.environ.get('CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
+# every web worker process creates its own provision and compute pools, so by default they share the host cores.
+# WEB_CONCURRENCY is the workers count of the gunicorn image, without it the image runs WORKERS_PER_CORE workers per core, at least 2.
+# PROVISION_WORKERS and COMPUTE_WORKERS set the pools sizes of every web worker explicitly
+CPU_COUNT = os.cpu_count() or 1
+WEB_WORKERS = int(os.environ.get('WEB_CONCURRENCY', max(int(float(os.environ.get('WORKERS_PER_CORE', 1)) * CPU_COUNT), 2)))
+WORKER_CPU_COUNT = max(CPU_COUNT // WEB_WORKERS, 1)
+
+PROVISION_WORKERS = int(os.environ.get('PROVISION_WORKERS', WORKER_CPU_COUNT))
+PROVISIONS_CACHE_MAX_BYTES = int(os.environ.get('PROVISIONS_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
+SOCIAL_MODELS_CACHE_MAX_BYTES = int(os.environ.get('SOCIAL_MODELS_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+ENGINEERING_MODELS_CACHE_MAX_BYTES = int(os.environ.get('ENGINEERING_MODELS_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+
+TILES_CACHE_MAX_BYTES = int(os.environ.get('TILES_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+
+JOBS_WORKERS = int(os.environ.get('JOBS_WORKERS', 2))
+
+COMPUTE_EXECUTOR = os.environ.get('COMPUTE_EXECUTOR', 'thread')
+COMPUTE_WORKERS = int(os.environ.get('COMPUTE_WORKERS', WORKER_CPU_COUNT))
+COMPUTE_KIND_LIMIT = int(os.environ.get('COMPUTE_KIND_LIMIT', 2))
+
+INDICATORS_WRITE_CONCURRENCY = int(os.environ.get('INDICATORS_WRITE_CONCURRENCY', 16))
+INDICATORS_WRITE_RETRIES = int(os.environ.get('INDICATORS_WRITE_RETRIES', 3))
+
+OBJECTS_REFRESH_INTERVAL = int(os.environ.get('OBJECTS_REFRESH_INTERVAL', 6 * 60 * 60))
@@ -1,16 +1,49 @@
-import json
-import geopandas as gpd
+import inspect
 from functools import wraps
-from shapely import set_precision
+from fastapi import Request
+from . import geojson, geoparquet, metrics
 
 PRECISION_GRID_SIZE = 0.0001
+# responses differ by Accept header, so caches must not serve one format for the other
+NEGOTIATION_HEADERS = {'Vary': 'Accept'}
 
-def gdf_to_geojson(func):
-    @wraps(func)
-    async def process(*args, **kwargs):
-        gdf = (await func(*args, **kwargs)).to_crs(4326)
-        # gdf.geometry = set_precision(gdf.geometry, grid_size=PRECISION_GRID_SIZE)
-        # for column in filter(lambda c : 'provision' in c, gdf):
-        #     gdf[column] = gdf[column].apply(lambda p : round(p,2))
-        return json.loads(gdf.to_json())
-    return process
\ No newline at end of file
+# documents alternative response formats in the endpoint schema
+FORMATS_RESPONSES = {
+    200: {
+        'content': {
+            geoparquet.PARQUET_MEDIA_TYPE: {'schema': {'type': 'string', 'format': 'binary'}}
+        }
+    }
+}
+
+def _accepts_parquet(request : Request) -> bool:
+    accept = request.headers.get('accept', '')
+    media_types = {media_type.split(';')[0].strip().lower() for media_type in accept.split(',')}
+    return len(media_types & geoparquet.PARQUET_MEDIA_TYPES) > 0
+
+def gdf_to_geojson(func=None, *, names_mapping : dict[str, str] | None = None, precision : int | None = None, grid_size : float | None = None):
+    """
+    Return endpoint GeoDataFrame as raw GeoJSON response or GeoParquet if requested by Accept header.
+    The endpoint return annotation still documents the schema, but the response is not revalidated against it
+    """
+    def decorator(func):
+        # e.g. provision.get_evaluation
+        endpoint = f'{func.__module__.rsplit(".", 1)[-1].removesuffix("_controller")}.{func.__name__}'
+
+        @wraps(func)
+        async def process(*args, negotiation_request : Request, **kwargs):
+            with metrics.endpoint(endpoint):
+                gdf = await func(*args, **kwargs)
+                with metrics.stage('serialize'):
+                    if _accepts_parquet(negotiation_request):
+                        return geoparquet.GeoParquetResponse(geoparquet.to_geoparquet(gdf, names_mapping, precision, grid_size), headers=NEGOTIATION_HEADERS)
+                    return geojson.GeoJSONResponse(geojson.to_geojson(gdf, names_mapping, precision, grid_size), headers=NEGOTIATION_HEADERS)
+
+        # request is injected by FastAPI for negotiation and is not passed to the endpoint
+        signature = inspect.signature(func)
+        request_parameter = inspect.Parameter('negotiation_request', inspect.Parameter.KEYWORD_ONLY, annotation=Request)
+        process.__signature__ = signature.replace(parameters=[*signature.parameters.values(), request_parameter])
+        return process
+    if func is not None:
+        return decorator(func)
+    return decorator
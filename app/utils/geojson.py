@@ -0,0 +1,48 @@
+import json
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from fastapi.responses import Response
+from .const import DEFAULT_CRS
+
+class GeoJSONResponse(Response):
+    media_type = 'application/json'
+
+def prepare_gdf(gdf : gpd.GeoDataFrame, names_mapping : dict[str, str] | None = None, precision : int | None = None, grid_size : float | None = None) -> gpd.GeoDataFrame:
+    """
+    Reproject, snap geometries to the grid and rename and round all properties at once, non finite values become NaNs
+    """
+    if gdf.crs is not None:
+        gdf = gdf.to_crs(DEFAULT_CRS)
+    geometry_name = gdf.geometry.name
+    geometries = gdf.geometry.values
+    if grid_size is not None:
+        geometries = shapely.set_precision(geometries, grid_size=grid_size)
+    df = pd.DataFrame(gdf.drop(columns=geometry_name))
+    if precision is not None:
+        df = df.round(precision)
+    if names_mapping is not None:
+        df = df.rename(columns=names_mapping)
+    numeric_columns = df.columns[[pd.api.types.is_numeric_dtype(dtype) for dtype in df.dtypes]]
+    df[numeric_columns] = df[numeric_columns].replace([np.inf, -np.inf], np.nan)
+    return gpd.GeoDataFrame(df, geometry=gpd.GeoSeries(geometries, index=gdf.index, crs=gdf.crs))
+
+def get_properties_records(df : pd.DataFrame) -> list[dict]:
+    # NaNs are not valid JSON values
+    return df.astype(object).where(df.notna(), None).to_dict('records')
+
+def to_geojson(gdf : gpd.GeoDataFrame, names_mapping : dict[str, str] | None = None, precision : int | None = None, grid_size : float | None = None) -> bytes:
+    """
+    Serialize GeoDataFrame into FeatureCollection bytes, geometries are written by GEOS and optionally snapped to the grid
+    """
+    gdf = prepare_gdf(gdf, names_mapping, precision, grid_size)
+    geometries_jsons = shapely.to_geojson(gdf.geometry.values)
+    properties_records = get_properties_records(pd.DataFrame(gdf.drop(columns=gdf.geometry.name)))
+    properties_jsons = [json.dumps(properties, ensure_ascii=False) for properties in properties_records]
+    ids_jsons = [json.dumps(str(i)) for i in gdf.index]
+    features = [
+        f'{{"id":{id_json},"type":"Feature","properties":{properties_json},"geometry":{"null" if geometry_json is None else geometry_json}}}'
+        for id_json, properties_json, geometry_json in zip(ids_jsons, properties_jsons, geometries_jsons)
+    ]
+    return f'{{"type":"FeatureCollection","features":[{",".join(features)}]}}'.encode()
@@ -0,0 +1,19 @@
+import io
+import geopandas as gpd
+from fastapi.responses import Response
+from . import geojson
+
+PARQUET_MEDIA_TYPE = 'application/vnd.apache.parquet'
+PARQUET_MEDIA_TYPES = {PARQUET_MEDIA_TYPE, 'application/x-parquet', 'application/geoparquet'}
+
+class GeoParquetResponse(Response):
+    media_type = PARQUET_MEDIA_TYPE
+
+def to_geoparquet(gdf : gpd.GeoDataFrame, names_mapping : dict[str, str] | None = None, precision : int | None = None, grid_size : float | None = None) -> bytes:
+    """
+    Serialize GeoDataFrame into GeoParquet bytes with the same properties and geometries the GeoJSON response has
+    """
+    gdf = geojson.prepare_gdf(gdf, names_mapping, precision, grid_size)
+    buffer = io.BytesIO()
+    gdf.to_parquet(buffer, compression='zstd')
+    return buffer.getvalue()
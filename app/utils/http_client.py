@@ -0,0 +1,87 @@
+import asyncio
+import time
+import httpx
+from urllib.parse import urlsplit
+from . import metrics
+from .const import HTTP_MAX_CONNECTIONS, HTTP_MAX_CONNECTIONS_PER_HOST, HTTP_CONNECT_TIMEOUT, HTTP_TIMEOUT
+
+# connections are bound to the event loop they were opened in, so clients are kept per loop
+_clients : dict[asyncio.AbstractEventLoop, httpx.AsyncClient] = {}
+_hosts_semaphores : dict[tuple[asyncio.AbstractEventLoop, str], asyncio.Semaphore] = {}
+
+def _create_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+        ),
+        timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        verify=False,
+    )
+
+async def open_client():
+    """
+    Create worker-wide client, should be called once in the app lifespan
+    """
+    get_client()
+
+async def close_client():
+    """
+    Close current loop client and drop its keep-alive connections
+    """
+    loop = asyncio.get_running_loop()
+    client = _clients.pop(loop, None)
+    if client is not None:
+        await client.aclose()
+    for key in [key for key in _hosts_semaphores if key[0] is loop]:
+        del _hosts_semaphores[key]
+
+def get_client() -> httpx.AsyncClient:
+    # created lazily for the code running outside of the app (scripts, notebooks)
+    loop = asyncio.get_running_loop()
+    if loop not in _clients:
+        _clients[loop] = _create_client()
+    return _clients[loop]
+
+def _get_host_semaphore(url : str) -> asyncio.Semaphore:
+    key = (asyncio.get_running_loop(), urlsplit(url).netloc)
+    if key not in _hosts_semaphores:
+        _hosts_semaphores[key] = asyncio.Semaphore(HTTP_MAX_CONNECTIONS_PER_HOST)
+    return _hosts_semaphores[key]
+
+def run_sync(coroutine):
+    """
+    Run coroutine from the sync code in its own loop and close the client opened for it
+    """
+    async def _run():
+        try:
+            return await coroutine
+        finally:
+            await close_client()
+    return asyncio.run(_run())
+
+async def request(method : str, url : str, params : dict | None = None, **kwargs) -> httpx.Response:
+    # requests used to drop None params, httpx sends them as empty strings
+    if params is not None:
+        params = {key : value for key, value in params.items() if value is not None}
+    function = metrics.get_current_function() or 'other'
+    host = urlsplit(url).netloc
+    status = 'error'
+    async with _get_host_semaphore(url):
+        started_at = time.perf_counter()
+        try:
+            res = await get_client().request(method, url, params=params, **kwargs)
+            status = res.status_code
+        finally:
+            metrics.upstream_requests_seconds.observe(time.perf_counter() - started_at, function=function, host=host, method=method, status=status)
+    metrics.upstream_received_bytes.inc(len(res.content), function=function, host=host)
+    return res
+
+async def get(url : str, params : dict | None = None, **kwargs) -> httpx.Response:
+    return await request('GET', url, params, **kwargs)
+
+async def put(url : str, params : dict | None = None, **kwargs) -> httpx.Response:
+    return await request('PUT', url, params, **kwargs)
+
+async def post(url : str, params : dict | None = None, **kwargs) -> httpx.Response:
+    return await request('POST', url, params, **kwargs)
@@ -0,0 +1,59 @@
+import asyncio
+import httpx
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+from loguru import logger
+from .const import INDICATORS_WRITE_CONCURRENCY, INDICATORS_WRITE_RETRIES
+
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 10
+
+@dataclass
+class WriteReport:
+    total : int = 0
+    succeeded : int = 0
+    failed : list[tuple[dict, str]] = field(default_factory=list)
+
+    def __str__(self):
+        return f'{self.succeeded}/{self.total} indicators values written, {len(self.failed)} failed'
+
+def _is_retryable(error : Exception) -> bool:
+    # client errors won't be fixed by repeating the same payload
+    if isinstance(error, httpx.HTTPStatusError):
+        status_code = error.response.status_code
+        return status_code >= 500 or status_code == 429
+    return isinstance(error, httpx.TransportError)
+
+def _describe(error : Exception) -> str:
+    if isinstance(error, httpx.HTTPStatusError):
+        return f'{error.response.status_code}: {error.response.text}'
+    return str(error) or type(error).__name__
+
+async def write(send : Callable[[dict], Awaitable], payloads : list[dict], concurrency : int = INDICATORS_WRITE_CONCURRENCY, retries : int = INDICATORS_WRITE_RETRIES) -> WriteReport:
+    """
+    Send every payload with bounded concurrency retrying transient errors with exponential backoff.
+    Failures do not stop other payloads and are collected into the report
+    """
+    report = WriteReport(total=len(payloads))
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _send(payload : dict):
+        async with semaphore:
+            for attempt in range(retries + 1):
+                try:
+                    await send(payload)
+                    report.succeeded += 1
+                    return
+                except Exception as e:
+                    if attempt == retries or not _is_retryable(e):
+                        report.failed.append((payload, _describe(e)))
+                        return
+                    await asyncio.sleep(min(BACKOFF_BASE * 2 ** attempt, BACKOFF_MAX))
+
+    await asyncio.gather(*[_send(payload) for payload in payloads])
+    if len(report.failed) > 0:
+        payload, error = report.failed[0]
+        logger.error(f'{report}, first failure: {error} for {payload}')
+    else:
+        logger.success(str(report))
+    return report
@@ -0,0 +1,308 @@
+import asyncio
+import contextvars
+import itertools
+import json
+import os
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from enum import Enum
+from typing import Any, Awaitable, Callable
+from loguru import logger
+from .const import DATA_PATH, JOBS_WORKERS
+
+JOBS_DB_PATH = os.path.join(DATA_PATH, 'jobs.sqlite')
+PROGRESS_FLUSH_INTERVAL = 1
+WAIT_INTERVAL = 2
+
+class JobStatus(Enum):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    INTERRUPTED = 'interrupted'
+
+ACTIVE_STATUSES = (JobStatus.QUEUED.value, JobStatus.RUNNING.value)
+
+# lower values are taken from the queue first
+PROJECT_PRIORITY = 0
+REGION_PRIORITY = 10
+
+_current_job_id : contextvars.ContextVar[str | None] = contextvars.ContextVar('current_job_id', default=None)
+# progress reported by running jobs of this process, flushed to the table by the job manager
+_progress : dict[str, dict[str, Any]] = {}
+_instances_ids : dict[int, str] = {}
+
+@contextmanager
+def _connect():
+    os.makedirs(os.path.dirname(JOBS_DB_PATH), exist_ok=True)
+    # the table is shared by app workers processes, writers wait for each other
+    connection = sqlite3.connect(JOBS_DB_PATH, timeout=30, isolation_level=None)
+    connection.row_factory = sqlite3.Row
+    try:
+        yield connection
+    finally:
+        connection.close()
+
+def _initialize_table():
+    with _connect() as connection:
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                region_id INTEGER,
+                scenario_id INTEGER,
+                priority INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                progress REAL,
+                message TEXT,
+                error TEXT,
+                pid INTEGER,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL
+            )
+        ''')
+        # columns added after the table was first deployed
+        columns = {row['name'] for row in connection.execute('PRAGMA table_info(jobs)')}
+        for column in ['instance', 'options']:
+            if column not in columns:
+                connection.execute(f'ALTER TABLE jobs ADD COLUMN {column} TEXT')
+        connection.execute('CREATE INDEX IF NOT EXISTS jobs_key ON jobs (kind, region_id, scenario_id, status)')
+
+def _get_start_time(pid : int) -> str | None:
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # process name may contain spaces, fields are counted after it, start time is the 22nd
+    return stat.rsplit(')', 1)[1].split()[19]
+
+def get_instance_id() -> str:
+    """
+    Id of the current process that is not repeated when the pid is reused, e.g. by a restarted container
+    """
+    pid = os.getpid()
+    if pid not in _instances_ids:
+        start_time = _get_start_time(pid)
+        _instances_ids[pid] = f'{pid}:{start_time or uuid.uuid4().hex}'
+    return _instances_ids[pid]
+
+def _is_alive(instance_id : str) -> bool:
+    pid, start_time = instance_id.split(':', 1)
+    pid = int(pid)
+    if instance_id == get_instance_id():
+        return True
+    current_start_time = _get_start_time(pid)
+    if current_start_time is not None:
+        return current_start_time == start_time
+    # without procfs only the pid can be checked
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _update(job_id : str, **values):
+    assignments = ', '.join(f'{column} = ?' for column in values)
+    with _connect() as connection:
+        connection.execute(f'UPDATE jobs SET {assignments} WHERE id = ?', [*values.values(), job_id])
+
+def _interrupt_orphans(connection : sqlite3.Connection):
+    # jobs of stopped processes will never finish
+    placeholders = ', '.join('?' for _ in ACTIVE_STATUSES)
+    rows = connection.execute(f'SELECT id, instance FROM jobs WHERE status IN ({placeholders})', ACTIVE_STATUSES).fetchall()
+    for row in rows:
+        if row['instance'] is None or not _is_alive(row['instance']):
+            connection.execute('UPDATE jobs SET status = ?, finished_at = ? WHERE id = ?', (JobStatus.INTERRUPTED.value, time.time(), row['id']))
+
+def _to_job(row : sqlite3.Row) -> dict[str, Any]:
+    job = dict(row)
+    job['options'] = None if job['options'] is None else json.loads(job['options'])
+    # progress not flushed yet is fresher than the stored one
+    return {**job, **_progress.get(job['id'], {})}
+
+def get_job(job_id : str) -> dict[str, Any] | None:
+    with _connect() as connection:
+        row = connection.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    return None if row is None else _to_job(row)
+
+def get_jobs(kind : str | None = None, region_id : int | None = None, status : JobStatus | None = None, limit : int = 100) -> list[dict[str, Any]]:
+    conditions = {'kind': kind, 'region_id': region_id, 'status': None if status is None else status.value}
+    conditions = {column : value for column, value in conditions.items() if value is not None}
+    where = ' AND '.join(f'{column} = ?' for column in conditions) or '1'
+    with _connect() as connection:
+        rows = connection.execute(f'SELECT * FROM jobs WHERE {where} ORDER BY created_at DESC LIMIT ?', [*conditions.values(), limit]).fetchall()
+    return [_to_job(row) for row in rows]
+
+def count_jobs(status : JobStatus) -> int:
+    with _connect() as connection:
+        return connection.execute('SELECT COUNT(*) FROM jobs WHERE status = ?', (status.value,)).fetchone()[0]
+
+def set_progress(progress : float, message : str | None = None):
+    """
+    Report current job progress from 0 to 1, does nothing outside of a job. Kept in memory and written to the table in the background
+    """
+    job_id = _current_job_id.get()
+    if job_id is None:
+        return
+    values = {'progress': min(max(progress, 0), 1)}
+    if message is not None:
+        values['message'] = message
+    _progress[job_id] = {**_progress.get(job_id, {}), **values}
+
+def _insert(kind : str, region_id : int | None, scenario_id : int | None, priority : int, options : str | None) -> tuple[str, bool, str | None]:
+    """
+    Find the active job of the same kind, region, scenario and options or insert a new one.
+    Returns the job id, whether it is new and the active job of the same key with other options it has to run after
+    """
+    with _connect() as connection:
+        connection.execute('BEGIN IMMEDIATE')
+        _interrupt_orphans(connection)
+        placeholders = ', '.join('?' for _ in ACTIVE_STATUSES)
+        rows = connection.execute(
+            f'SELECT id, options FROM jobs WHERE kind = ? AND region_id IS ? AND scenario_id IS ? AND status IN ({placeholders}) ORDER BY created_at',
+            (kind, region_id, scenario_id, *ACTIVE_STATUSES)
+        ).fetchall()
+        for row in rows:
+            if row['options'] == options:
+                connection.execute('COMMIT')
+                return row['id'], False, None
+        job_id = uuid.uuid4().hex
+        connection.execute(
+            'INSERT INTO jobs (id, kind, region_id, scenario_id, priority, status, pid, instance, options, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (job_id, kind, region_id, scenario_id, priority, JobStatus.QUEUED.value, os.getpid(), get_instance_id(), options, time.time())
+        )
+        connection.execute('COMMIT')
+        return job_id, True, rows[-1]['id'] if len(rows) > 0 else None
+
+def _poll(job_id : str) -> dict[str, Any] | None:
+    # jobs of stopped workers are never finished by them
+    with _connect() as connection:
+        _interrupt_orphans(connection)
+    return get_job(job_id)
+
+async def wait(job_id : str) -> dict[str, Any] | None:
+    """
+    Wait for the job of any worker to finish and return it
+    """
+    while True:
+        job = await asyncio.to_thread(_poll, job_id)
+        if job is None or job['status'] not in ACTIVE_STATUSES:
+            return job
+        await asyncio.sleep(WAIT_INTERVAL)
+
+def _interrupt(jobs_ids : list[str] | None = None):
+    with _connect() as connection:
+        if jobs_ids is None:
+            _interrupt_orphans(connection)
+            return
+        for job_id in jobs_ids:
+            connection.execute('UPDATE jobs SET status = ?, finished_at = ? WHERE id = ?', (JobStatus.INTERRUPTED.value, time.time(), job_id))
+
+def _flush_progress():
+    for job_id in list(_progress):
+        _update(job_id, **_progress.pop(job_id))
+
+class JobManager():
+    """
+    Bounded pool of workers running queued jobs by priority. Active jobs of the same kind, region and scenario are coalesced
+    into one if their options are the same and run one after another otherwise
+    """
+
+    def __init__(self, workers : int = JOBS_WORKERS):
+        self.workers = workers
+        self._queue : asyncio.PriorityQueue | None = None
+        self._counter = itertools.count()
+        self._functions : dict[str, Callable[[], Awaitable]] = {}
+        self._tasks : list[asyncio.Task] = []
+        self._followers : set[asyncio.Task] = set()
+
+    async def start(self):
+        await asyncio.to_thread(_initialize_table)
+        await asyncio.to_thread(_interrupt)
+        self._queue = asyncio.PriorityQueue()
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._flush()))
+
+    async def stop(self):
+        tasks = [*self._tasks, *self._followers]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        self._followers = set()
+        # queued jobs are lost with the process
+        await asyncio.to_thread(_interrupt, list(self._functions))
+        self._functions = {}
+
+    async def submit(self, kind : str, func : Callable[..., Awaitable], *args, region_id : int | None = None, scenario_id : int | None = None, priority : int = REGION_PRIORITY, options : dict | None = None, **kwargs) -> str:
+        """
+        Queue the job and return its id, or the id of the active job of the same kind, region, scenario and options.
+        Job with other options than the active one of the same key is queued once that one finishes, so they never run at the same time
+        """
+        options = None if options is None else json.dumps(options, sort_keys=True)
+        job_id, created, previous_job_id = await asyncio.to_thread(_insert, kind, region_id, scenario_id, priority, options)
+        if not created:
+            logger.info(f'{kind} job for {region_id} is already active as {job_id}')
+            return job_id
+        self._functions[job_id] = lambda : func(*args, **kwargs)
+        if previous_job_id is None:
+            self._queue.put_nowait((priority, next(self._counter), job_id))
+        else:
+            logger.info(f'{kind} job {job_id} for {region_id} is queued after {previous_job_id}')
+            task = asyncio.create_task(self._queue_after(previous_job_id, priority, job_id))
+            self._followers.add(task)
+            task.add_done_callback(self._followers.discard)
+        return job_id
+
+    async def _queue_after(self, previous_job_id : str, priority : int, job_id : str):
+        try:
+            await wait(previous_job_id)
+        except Exception as e:
+            logger.error(f'Failed to wait for job {previous_job_id}: {e}')
+        self._queue.put_nowait((priority, next(self._counter), job_id))
+
+    @property
+    def queue_size(self) -> int:
+        return 0 if self._queue is None else self._queue.qsize()
+
+    async def _run(self, job_id : str):
+        func = self._functions.pop(job_id)
+        _current_job_id.set(job_id)
+        await asyncio.to_thread(_update, job_id, status=JobStatus.RUNNING.value, started_at=time.time())
+        try:
+            await func()
+            _progress.pop(job_id, None)
+            await asyncio.to_thread(_update, job_id, status=JobStatus.SUCCEEDED.value, progress=1, finished_at=time.time())
+        except asyncio.CancelledError:
+            values = _progress.pop(job_id, {})
+            await asyncio.to_thread(_update, job_id, **values, status=JobStatus.INTERRUPTED.value, finished_at=time.time())
+            raise
+        except Exception as e:
+            logger.error(f'Job {job_id} failed: {e}')
+            values = _progress.pop(job_id, {})
+            await asyncio.to_thread(_update, job_id, **values, status=JobStatus.FAILED.value, error=str(e), finished_at=time.time())
+
+    async def _work(self):
+        while True:
+            _, _, job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            finally:
+                self._queue.task_done()
+
+    async def _flush(self):
+        while True:
+            await asyncio.sleep(PROGRESS_FLUSH_INTERVAL)
+            try:
+                await asyncio.to_thread(_flush_progress)
+            except Exception as e:
+                logger.error(f'Failed to save jobs progress: {e}')
+
+job_manager = JobManager()
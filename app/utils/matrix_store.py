@@ -0,0 +1,130 @@
+import asyncio
+import json
+import os
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from loguru import logger
+from . import api_client
+from .const import DATA_PATH
+
+MATRICES_PATH = os.path.join(DATA_PATH, 'matrices')
+VALUES_FILE = 'values.npy'
+INDEX_FILE = 'index.npy'
+COLUMNS_FILE = 'columns.npy'
+META_FILE = 'meta.json'
+DTYPE = np.float32
+
+class NoCopyMatrix():
+    """
+    Wrapper handing the memory-mapped matrix to ProvisionModel, which otherwise copies it in its constructor
+    """
+
+    def __init__(self, acc_mx : pd.DataFrame):
+        self._acc_mx = acc_mx
+        self.index = acc_mx.index
+        self.columns = acc_mx.columns
+
+    def copy(self, deep : bool = True) -> pd.DataFrame:
+        return self._acc_mx
+
+def get_fingerprint(ids) -> str:
+    """
+    Fingerprint of the ids set the matrix was built for, e.g. region towns
+    """
+    ids = np.sort(np.asarray(list(ids), dtype=np.int64))
+    return hashlib.sha1(ids.tobytes()).hexdigest()
+
+def _get_dir_path(region_id : int, graph_type : str, regional_scenario_id : int | None = None) -> str:
+    dir_name = f'{region_id}_{graph_type}'
+    if regional_scenario_id is not None:
+        dir_name = f'{dir_name}_{regional_scenario_id}'
+    return os.path.join(MATRICES_PATH, dir_name)
+
+def _read_meta(dir_path : str) -> dict | None:
+    meta_path = os.path.join(dir_path, META_FILE)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        return json.load(f)
+
+def exists(region_id : int, graph_type : str = api_client.GRAPH_TYPE, regional_scenario_id : int | None = None, fingerprint : str | None = None) -> bool:
+    meta = _read_meta(_get_dir_path(region_id, graph_type, regional_scenario_id))
+    if meta is None:
+        return False
+    return fingerprint is None or meta.get('fingerprint') == fingerprint
+
+def _swap(dir_path : str, version_path : str):
+    """
+    Point the matrix directory link to the version directory atomically and remove the previous version
+    """
+    previous_path = os.path.realpath(dir_path) if os.path.lexists(dir_path) else None
+    if previous_path is not None and not os.path.islink(dir_path):
+        # directories written before versioning can't be replaced by a link, so they are moved aside first
+        previous_path = f'{dir_path}.{os.getpid()}.old'
+        os.replace(dir_path, previous_path)
+    link_path = f'{dir_path}.{os.getpid()}.link'
+    os.symlink(os.path.basename(version_path), link_path)
+    os.replace(link_path, dir_path)
+    if previous_path is not None:
+        # readers holding the old files keep them, readers resolving the link meanwhile retry
+        shutil.rmtree(previous_path, ignore_errors=True)
+
+def save(acc_mx : pd.DataFrame, region_id : int, graph_type : str = api_client.GRAPH_TYPE, regional_scenario_id : int | None = None, fingerprint : str | None = None):
+    dir_path = _get_dir_path(region_id, graph_type, regional_scenario_id)
+    os.makedirs(MATRICES_PATH, exist_ok=True)
+    # every save is a new version directory, so concurrent readers never see a partial matrix
+    version_path = tempfile.mkdtemp(dir=MATRICES_PATH, prefix=f'{os.path.basename(dir_path)}.')
+    np.save(os.path.join(version_path, VALUES_FILE), np.ascontiguousarray(acc_mx.values, dtype=DTYPE))
+    np.save(os.path.join(version_path, INDEX_FILE), np.asarray(acc_mx.index, dtype=np.int64))
+    np.save(os.path.join(version_path, COLUMNS_FILE), np.asarray(acc_mx.columns, dtype=np.int64))
+    with open(os.path.join(version_path, META_FILE), 'w') as f:
+        json.dump({
+            'fingerprint': fingerprint,
+            'shape': list(acc_mx.shape),
+            'dtype': np.dtype(DTYPE).name,
+            'saved_at': datetime.now().isoformat()
+        }, f)
+    _swap(dir_path, version_path)
+
+def _load(dir_path : str) -> pd.DataFrame:
+    # files are read from the resolved version, so all of them belong to the same save
+    version_path = os.path.realpath(dir_path)
+    values = np.load(os.path.join(version_path, VALUES_FILE), mmap_mode='r')
+    index = np.load(os.path.join(version_path, INDEX_FILE))
+    columns = np.load(os.path.join(version_path, COLUMNS_FILE))
+    return pd.DataFrame(values, index=index, columns=columns, copy=False)
+
+def load(region_id : int, graph_type : str = api_client.GRAPH_TYPE, regional_scenario_id : int | None = None) -> pd.DataFrame:
+    """
+    Load the matrix memory-mapped, values are read from disk on access and shared between processes by the OS
+    """
+    dir_path = _get_dir_path(region_id, graph_type, regional_scenario_id)
+    try:
+        return _load(dir_path)
+    except FileNotFoundError:
+        # the version was replaced by another worker while being read
+        return _load(dir_path)
+
+def delete(region_id : int, graph_type : str = api_client.GRAPH_TYPE, regional_scenario_id : int | None = None) -> bool:
+    dir_path = _get_dir_path(region_id, graph_type, regional_scenario_id)
+    if not os.path.lexists(dir_path):
+        return False
+    version_path = os.path.realpath(dir_path)
+    if os.path.islink(dir_path):
+        os.remove(dir_path)
+    shutil.rmtree(version_path, ignore_errors=True)
+    return True
+
+async def get_accessibility_matrix(region_id : int, graph_type : str = api_client.GRAPH_TYPE, regional_scenario_id : int | None = None, fingerprint : str | None = None, refresh : bool = False) -> pd.DataFrame:
+    """
+    Get the stored matrix, fetching it from Transport Frames if missing, outdated by fingerprint or refresh is requested
+    """
+    if refresh or not exists(region_id, graph_type, regional_scenario_id, fingerprint):
+        logger.info(f'Fetching {region_id} accessibility matrix')
+        acc_mx = await api_client.get_accessibility_matrix(region_id, graph_type)
+        await asyncio.to_thread(save, acc_mx, region_id, graph_type, regional_scenario_id, fingerprint)
+    return load(region_id, graph_type, regional_scenario_id)
@@ -0,0 +1,204 @@
+import bisect
+import contextvars
+import math
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Callable
+
+# every process of the deployment keeps its own values, scrape the workers separately or aggregate by instance
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(10))
+PREFIX = 'townsnet'
+
+_current_function : contextvars.ContextVar[str | None] = contextvars.ContextVar('current_function', default=None)
+_current_endpoint : contextvars.ContextVar[str] = contextvars.ContextVar('current_endpoint', default='other')
+
+def _format_value(value : float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+def _format_labels(labels : dict[str, Any]) -> str:
+    if len(labels) == 0:
+        return ''
+    escaped = {name : str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for name, value in labels.items()}
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped.items()) + '}'
+
+class _Metric():
+    type = 'untyped'
+
+    def __init__(self, name : str, documentation : str, labels : tuple[str, ...] = ()):
+        self.name = f'{PREFIX}_{name}'
+        self.documentation = documentation
+        self.labels = labels
+        _registry.append(self)
+
+    def _key(self, labels : dict[str, Any]) -> tuple:
+        return tuple(str(labels.get(label, '')) for label in self.labels)
+
+    def _samples(self) -> list[tuple[str, dict[str, Any], float]]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        for name, labels, value in self._samples():
+            lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines)
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def __init__(self, name : str, documentation : str, labels : tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self._values : dict[tuple, float] = {}
+
+    def inc(self, value : float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + value
+
+    def _samples(self):
+        return [(self.name, dict(zip(self.labels, key)), value) for key, value in self._values.items()]
+
+class Gauge(_Metric):
+    """
+    Gauge with values set directly or collected by the function on scrape
+    """
+    type = 'gauge'
+
+    def __init__(self, name : str, documentation : str, labels : tuple[str, ...] = (), collect : Callable[[], dict[tuple, float]] | None = None):
+        super().__init__(name, documentation, labels)
+        self._values : dict[tuple, float] = {}
+        self._collect = collect
+
+    def set(self, value : float, **labels):
+        self._values[self._key(labels)] = value
+
+    def _samples(self):
+        values = self._values if self._collect is None else self._collect()
+        return [(self.name, dict(zip(self.labels, key)), value) for key, value in values.items()]
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name : str, documentation : str, labels : tuple[str, ...] = (), buckets : tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._counts : dict[tuple, list[int]] = {}
+        self._sums : dict[tuple, float] = {}
+
+    def observe(self, value : float, **labels):
+        key = self._key(labels)
+        if key not in self._counts:
+            # the last one is the +Inf bucket
+            self._counts[key] = [0] * (len(self.buckets) + 1)
+            self._sums[key] = 0
+        self._counts[key][bisect.bisect_left(self.buckets, value)] += 1
+        self._sums[key] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+    def _samples(self):
+        samples = []
+        for key, counts in self._counts.items():
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip([*self.buckets, math.inf], counts):
+                cumulative += count
+                samples.append((f'{self.name}_bucket', {**labels, 'le': _format_value(bound)}, cumulative))
+            samples.append((f'{self.name}_sum', labels, self._sums[key]))
+            samples.append((f'{self.name}_count', labels, cumulative))
+        return samples
+
+_registry : list[_Metric] = []
+
+def render() -> str:
+    """
+    All metrics in Prometheus text exposition format
+    """
+    return '\n'.join(metric.render() for metric in _registry) + '\n'
+
+def measure(func : Callable, *args, **kwargs) -> tuple[float, Any]:
+    """
+    Call the function returning its duration with the result, works inside executors where metrics can't be recorded
+    """
+    started_at = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - started_at, result
+
+upstream_calls_seconds = Histogram('upstream_call_seconds', 'api_client functions durations including pagination', ('function',))
+upstream_requests_seconds = Histogram('upstream_request_seconds', 'Upstream HTTP requests durations', ('function', 'host', 'method', 'status'))
+upstream_received_bytes = Counter('upstream_received_bytes_total', 'Upstream responses bodies sizes', ('function', 'host'))
+stages_seconds = Histogram('stage_seconds', 'Endpoints stages durations', ('endpoint', 'stage'))
+provision_calculations_seconds = Histogram('provision_calculation_seconds', 'ProvisionModel.calculate durations', ('service_type_id',))
+http_requests_seconds = Histogram('http_request_seconds', 'Served requests durations', ('route', 'method', 'status'))
+http_responses_bytes = Histogram('http_response_bytes', 'Served responses payloads sizes before compression', ('route', 'method'), SIZE_BUCKETS)
+
+@contextmanager
+def endpoint(name : str):
+    """
+    Attribute stages timed inside to the endpoint
+    """
+    token = _current_endpoint.set(name)
+    try:
+        yield
+    finally:
+        _current_endpoint.reset(token)
+
+def stage(name : str):
+    return stages_seconds.time(endpoint=_current_endpoint.get(), stage=name)
+
+def get_current_function() -> str | None:
+    return _current_function.get()
+
+def upstream_call(func):
+    """
+    Time api_client function and label upstream requests made inside with its name
+    """
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        token = _current_function.set(func.__name__)
+        try:
+            with upstream_calls_seconds.time(function=func.__name__):
+                return await func(*args, **kwargs)
+        finally:
+            _current_function.reset(token)
+    return wrapper
+
+class MetricsMiddleware():
+    """
+    ASGI middleware recording served requests durations and payloads sizes by route template
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        started_at = time.perf_counter()
+        status = 500
+        size = 0
+
+        async def _send(message):
+            nonlocal status, size
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            elif message['type'] == 'http.response.body':
+                size += len(message.get('body', b''))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            # unmatched paths are collapsed so scanners can't blow up the labels
+            route = scope.get('route')
+            route_path = getattr(route, 'path', 'unmatched')
+            http_requests_seconds.observe(time.perf_counter() - started_at, route=route_path, method=scope['method'], status=status)
+            http_responses_bytes.observe(size, route=route_path, method=scope['method'])
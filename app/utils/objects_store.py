@@ -0,0 +1,169 @@
+import asyncio
+import json
+import os
+import time
+import shapely
+import pandas as pd
+import geopandas as gpd
+from typing import Hashable, Iterable
+from datetime import datetime
+from loguru import logger
+from . import api_client
+from .const import DATA_PATH, OBJECTS_REFRESH_INTERVAL
+
+OBJECTS_PATH = os.path.join(DATA_PATH, 'physical_objects')
+GEOMETRY_COLUMN = 'geometry'
+
+_pending : dict[tuple[asyncio.AbstractEventLoop, int, int], asyncio.Task] = {}
+
+def _get_snapshot_path(region_id : int, pot_id : int) -> str:
+    return os.path.join(OBJECTS_PATH, str(region_id), f'{pot_id}.parquet')
+
+def _get_meta_path(region_id : int, pot_id : int) -> str:
+    return os.path.join(OBJECTS_PATH, str(region_id), f'{pot_id}.json')
+
+def _read_meta(region_id : int, pot_id : int) -> dict | None:
+    meta_path = _get_meta_path(region_id, pot_id)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        return json.load(f)
+
+def _write_meta(meta : dict, region_id : int, pot_id : int):
+    meta_path = _get_meta_path(region_id, pot_id)
+    tmp_path = f'{meta_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
+
+def exists(region_id : int, pot_id : int) -> bool:
+    return _read_meta(region_id, pot_id) is not None
+
+def is_stale(region_id : int, pot_id : int, interval : float = OBJECTS_REFRESH_INTERVAL) -> bool:
+    meta = _read_meta(region_id, pot_id)
+    return meta is None or time.time() - meta['synced_at'] >= interval
+
+def _encode(gdf : gpd.GeoDataFrame) -> tuple[gpd.GeoDataFrame, list[str]]:
+    # nested upstream attributes (type, territory, properties) have no stable parquet schema, so they are kept as json
+    df = gdf.copy()
+    json_columns = [column for column in df.columns if column != GEOMETRY_COLUMN and df[column].map(lambda v : isinstance(v, (dict, list))).any()]
+    for column in json_columns:
+        df[column] = df[column].map(lambda v : None if v is None else json.dumps(v, ensure_ascii=False, sort_keys=True))
+    return df, json_columns
+
+def _decode(df : gpd.GeoDataFrame, json_columns : list[str]) -> gpd.GeoDataFrame:
+    for column in json_columns:
+        df[column] = df[column].map(lambda v : None if v is None else json.loads(v))
+    return df
+
+def _get_hashes(gdf : gpd.GeoDataFrame) -> pd.Series:
+    """
+    Objects hashes by id, objects attributes or geometry change changes the hash
+    """
+    df = pd.DataFrame(_encode(gdf)[0])
+    df[GEOMETRY_COLUMN] = shapely.to_wkb(gdf.geometry.values, hex=True)
+    return pd.util.hash_pandas_object(df.astype(str), index=False)
+
+def _diff(old_gdf : gpd.GeoDataFrame | None, new_gdf : gpd.GeoDataFrame | None) -> dict[str, int]:
+    old_hashes = pd.Series(dtype='uint64') if old_gdf is None else _get_hashes(old_gdf)
+    new_hashes = pd.Series(dtype='uint64') if new_gdf is None else _get_hashes(new_gdf)
+    common = old_hashes.index.intersection(new_hashes.index)
+    return {
+        'added': len(new_hashes.index.difference(old_hashes.index)),
+        'removed': len(old_hashes.index.difference(new_hashes.index)),
+        'changed': int((old_hashes[common] != new_hashes[common]).sum()),
+    }
+
+def save(gdf : gpd.GeoDataFrame | None, region_id : int, pot_id : int):
+    snapshot_path = _get_snapshot_path(region_id, pot_id)
+    os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
+    meta = {'synced_at': time.time(), 'count': 0, 'json_columns': [], 'saved_at': datetime.now().isoformat()}
+    if gdf is not None:
+        df, json_columns = _encode(gdf)
+        # written aside and swapped so readers never see a partial file
+        tmp_path = f'{snapshot_path}.{os.getpid()}.tmp'
+        df.to_parquet(tmp_path)
+        os.replace(tmp_path, snapshot_path)
+        meta = {**meta, 'count': len(gdf), 'json_columns': json_columns}
+    elif os.path.exists(snapshot_path):
+        os.remove(snapshot_path)
+    # meta goes last, it is what tells the snapshot exists
+    _write_meta(meta, region_id, pot_id)
+
+def touch(region_id : int, pot_id : int):
+    meta = _read_meta(region_id, pot_id)
+    _write_meta({**meta, 'synced_at': time.time()}, region_id, pot_id)
+
+def load(region_id : int, pot_id : int) -> gpd.GeoDataFrame | None:
+    """
+    Load the snapshot the way api_client.get_physical_objects returns objects, None if there are none
+    """
+    meta = _read_meta(region_id, pot_id)
+    if meta is None or meta['count'] == 0:
+        return None
+    gdf = gpd.read_parquet(_get_snapshot_path(region_id, pot_id))
+    return _decode(gdf, meta['json_columns'])
+
+def _get_saved_at(region_id : int, pots_ids : list[int]) -> tuple[str | None, ...]:
+    metas = [_read_meta(region_id, pot_id) for pot_id in pots_ids]
+    return tuple(None if meta is None else meta['saved_at'] for meta in metas)
+
+async def get_version(region_id : int, pots_ids : Iterable[int]) -> tuple[str | None, ...]:
+    """
+    Snapshots saving times, changed by any worker rewriting the snapshots. Missing snapshots are synced first
+    """
+    pots_ids = list(dict.fromkeys(pots_ids))
+    version = await asyncio.to_thread(_get_saved_at, region_id, pots_ids)
+    missing_pots_ids = [pot_id for pot_id, saved_at in zip(pots_ids, version) if saved_at is None]
+    if len(missing_pots_ids) == 0:
+        return version
+    await asyncio.gather(*[sync(region_id, pot_id) for pot_id in missing_pots_ids])
+    return await asyncio.to_thread(_get_saved_at, region_id, pots_ids)
+
+async def _sync(region_id : int, pot_id : int) -> bool:
+    new_gdf = await api_client.get_physical_objects(region_id, pot_id)
+    snapshot_exists = await asyncio.to_thread(exists, region_id, pot_id)
+    old_gdf = await asyncio.to_thread(load, region_id, pot_id) if snapshot_exists else None
+    diff = await asyncio.to_thread(_diff, old_gdf, new_gdf)
+    if snapshot_exists and sum(diff.values()) == 0:
+        await asyncio.to_thread(touch, region_id, pot_id)
+        return False
+    await asyncio.to_thread(save, new_gdf, region_id, pot_id)
+    logger.info(f'{region_id} region {pot_id} physical objects synced: {diff}')
+    return True
+
+async def sync(region_id : int, pot_id : int) -> bool:
+    """
+    Fetch all objects of the type and rewrite the snapshot if anything changed, returns whether it did.
+    The upstream has no changed-since filter, so every sync is a full diff. Concurrent syncs of the same snapshot share a single fetch
+    """
+    pending_key = (asyncio.get_running_loop(), region_id, pot_id)
+    task = _pending.get(pending_key)
+    if task is None:
+        task = asyncio.ensure_future(_sync(region_id, pot_id))
+        _pending[pending_key] = task
+        task.add_done_callback(lambda _ : _pending.pop(pending_key, None))
+    return await asyncio.shield(task)
+
+async def get_physical_objects(region_id : int, pot_id : int, refresh : bool = False) -> gpd.GeoDataFrame | None:
+    """
+    Get objects from the snapshot, syncing it with the upstream if it is missing or refresh is requested
+    """
+    if refresh or not await asyncio.to_thread(exists, region_id, pot_id):
+        await sync(region_id, pot_id)
+    return await asyncio.to_thread(load, region_id, pot_id)
+
+async def get_physical_objects_many(region_id : int, pots_ids : Iterable[int], refresh : bool = False) -> dict[int, gpd.GeoDataFrame | None]:
+    """
+    Get objects of every distinct type once, repeated types are read a single time
+    """
+    pots_ids = list(dict.fromkeys(pots_ids))
+    gdfs = await asyncio.gather(*[get_physical_objects(region_id, pot_id, refresh) for pot_id in pots_ids])
+    return dict(zip(pots_ids, gdfs))
+
+async def fetch_groups(region_id : int, groups : dict[Hashable, list[int]], refresh : bool = False) -> dict[Hashable, list[gpd.GeoDataFrame | None]]:
+    """
+    Fetch the union of the groups types once and hand the same frames out to every group that lists the type
+    """
+    pots_gdfs = await get_physical_objects_many(region_id, [pot_id for pots_ids in groups.values() for pot_id in pots_ids], refresh)
+    return {group : [pots_gdfs[pot_id] for pot_id in pots_ids] for group, pots_ids in groups.items()}
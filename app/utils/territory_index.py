@@ -0,0 +1,110 @@
+import asyncio
+import pandas as pd
+import geopandas as gpd
+from dataclasses import dataclass, field
+from . import api_client
+from .cache import cached
+
+REGION_LEVEL = 2
+
+def _get_parents_ids(territories_gdf : gpd.GeoDataFrame) -> pd.Series:
+    if 'parent' in territories_gdf.columns:
+        return territories_gdf['parent'].apply(lambda p : p.get('id') if isinstance(p, dict) else None)
+    if 'parent_id' in territories_gdf.columns:
+        return territories_gdf['parent_id']
+    return pd.Series(None, index=territories_gdf.index)
+
+def _get_levels_names(gdfs : dict[int, gpd.GeoDataFrame]) -> dict[int, str]:
+    # the most common territory type name of each level
+    levels_names = {}
+    for level, gdf in gdfs.items():
+        territory_types_names = gdf['territory_type'].apply(lambda tt : tt['name'])
+        levels_names[level] = territory_types_names.value_counts().idxmax()
+    return levels_names
+
+@dataclass
+class TerritoryIndex():
+    """
+    Region territories hierarchy prepared for lookups by level, parent and city flag
+    """
+    region_id : int
+    region_gdf : gpd.GeoDataFrame
+    levels_gdfs : dict[int, gpd.GeoDataFrame]
+    units_gdfs : dict[int, gpd.GeoDataFrame]
+    towns_gdf : gpd.GeoDataFrame
+    is_city : pd.Series
+    parents : dict[int, int | None]
+    children : dict[int, list[int]]
+    levels_names : dict[int, str] = field(default_factory=dict)
+    units_levels_names : dict[int, str] = field(default_factory=dict)
+
+    @property
+    def levels(self) -> list[int]:
+        return sorted(self.levels_gdfs.keys())
+
+    def get_territories(self, level : int) -> gpd.GeoDataFrame:
+        """
+        All level territories including cities
+        """
+        return self.levels_gdfs[level].copy(deep=False)
+
+    def get_units(self, level : int) -> gpd.GeoDataFrame:
+        """
+        Level administrative units excluding cities
+        """
+        return self.units_gdfs[level].copy(deep=False)
+
+    def get_towns(self) -> gpd.GeoDataFrame:
+        return self.towns_gdf.copy(deep=False)
+
+    def get_children(self, territory_id : int) -> list[int]:
+        return list(self.children.get(territory_id, []))
+
+    def get_parent(self, territory_id : int) -> int | None:
+        return self.parents.get(territory_id)
+
+def build_territory_index(region_id : int, regions_gdf : gpd.GeoDataFrame, territories_gdf : gpd.GeoDataFrame) -> TerritoryIndex:
+    region_gdf = regions_gdf[regions_gdf.index == region_id]
+    territories_gdf = territories_gdf.copy()
+    is_city = territories_gdf['is_city'].fillna(False).astype(bool)
+    # hierarchy maps
+    parents = {territory_id : None if pd.isna(parent_id) else int(parent_id) for territory_id, parent_id in _get_parents_ids(territories_gdf).items()}
+    children = {}
+    for territory_id, parent_id in parents.items():
+        children.setdefault(parent_id, []).append(territory_id)
+    # level frames
+    levels_gdfs = {REGION_LEVEL : region_gdf}
+    units_gdfs = {REGION_LEVEL : region_gdf}
+    for level, level_gdf in territories_gdf.groupby('level'):
+        levels_gdfs[level] = level_gdf
+        units_gdf = level_gdf[~is_city.loc[level_gdf.index]]
+        if len(units_gdf) > 0:
+            units_gdfs[level] = units_gdf
+    towns_gdf = territories_gdf[is_city]
+    # spatial indices are built lazily by geopandas, touching them prebuilds once per region
+    if 'geometry' in territories_gdf:
+        for gdf in [towns_gdf, *levels_gdfs.values(), *units_gdfs.values()]:
+            gdf.sindex
+    return TerritoryIndex(
+        region_id=region_id,
+        region_gdf=region_gdf,
+        levels_gdfs=levels_gdfs,
+        units_gdfs=units_gdfs,
+        towns_gdf=towns_gdf,
+        is_city=is_city,
+        parents=parents,
+        children=children,
+        levels_names=_get_levels_names(levels_gdfs),
+        units_levels_names=_get_levels_names(units_gdfs),
+    )
+
+@cached(api_client.TERRITORIES_TTL, region_arg='region_id')
+async def get_territory_index(region_id : int) -> TerritoryIndex:
+    """
+    Fetch region territories with geometry once and build the index
+    """
+    regions_gdf, territories_gdf = await asyncio.gather(
+        api_client.get_regions(True),
+        api_client.get_territories(region_id, all_levels=True, geometry=True)
+    )
+    return await asyncio.to_thread(build_territory_index, region_id, regions_gdf, territories_gdf)
@@ -0,0 +1,84 @@
+import shapely
+import geopandas as gpd
+import mapbox_vector_tile
+from typing import Awaitable, Callable
+from fastapi import HTTPException
+from fastapi.responses import Response
+from . import geojson, compute, metrics
+from .cache import TTLCache, REGION_TAG, invalidate_region
+from .const import TILES_CACHE_MAX_BYTES
+
+MVT_MEDIA_TYPE = 'application/vnd.mapbox-vector-tile'
+WEB_MERCATOR_CRS = 3857
+WEB_MERCATOR_HALF_SIZE = 20037508.342789244
+TILE_EXTENT = 4096
+# features are clipped a bit outside of the tile so their edges are not drawn on tiles borders
+TILE_BUFFER = 64
+MAX_ZOOM = 22
+
+TILES_CACHE_TTL = 60 * 60
+LAYERS_CACHE_TTL = 10 * 60
+tiles_cache = TTLCache(TILES_CACHE_MAX_BYTES)
+
+class TileResponse(Response):
+    media_type = MVT_MEDIA_TYPE
+
+def get_tile_bounds(z : int, x : int, y : int) -> tuple[float, float, float, float]:
+    """
+    Tile bounds in Web Mercator by XYZ scheme
+    """
+    tiles_count = 2 ** z
+    if z < 0 or z > MAX_ZOOM or not (0 <= x < tiles_count and 0 <= y < tiles_count):
+        raise HTTPException(status_code=400, detail=f'Invalid tile {z}/{x}/{y}')
+    tile_size = 2 * WEB_MERCATOR_HALF_SIZE / tiles_count
+    min_x = -WEB_MERCATOR_HALF_SIZE + x * tile_size
+    max_y = WEB_MERCATOR_HALF_SIZE - y * tile_size
+    return min_x, max_y - tile_size, min_x + tile_size, max_y
+
+def _project_layer(gdf : gpd.GeoDataFrame, names_mapping : dict[str, str] | None = None, precision : int | None = None) -> gpd.GeoDataFrame:
+    gdf = geojson.prepare_gdf(gdf, names_mapping, precision).to_crs(WEB_MERCATOR_CRS)
+    gdf.sindex
+    return gdf
+
+def encode_tile(gdf : gpd.GeoDataFrame, z : int, x : int, y : int, layer_name : str) -> bytes:
+    """
+    Clip Web Mercator layer features by the tile and encode them as Mapbox Vector Tile
+    """
+    bounds = get_tile_bounds(z, x, y)
+    buffer = (bounds[2] - bounds[0]) * TILE_BUFFER / TILE_EXTENT
+    clip_bounds = (bounds[0] - buffer, bounds[1] - buffer, bounds[2] + buffer, bounds[3] + buffer)
+    gdf = gdf.iloc[gdf.sindex.query(shapely.box(*clip_bounds))]
+    geometries = shapely.clip_by_rect(gdf.geometry.values, *clip_bounds)
+    properties_records = geojson.get_properties_records(gdf.drop(columns=gdf.geometry.name))
+    features = [
+        {'geometry': geometry, 'properties': {key : value for key, value in properties.items() if value is not None}}
+        for geometry, properties in zip(geometries, properties_records)
+        if geometry is not None and not geometry.is_empty
+    ]
+    return mapbox_vector_tile.encode(
+        [{'name': layer_name, 'features': features}],
+        default_options={'quantize_bounds': bounds, 'extents': TILE_EXTENT}
+    )
+
+async def get_tile(region_id : int, layer_key : tuple, z : int, x : int, y : int, layer_name : str, load_layer : Callable[[], Awaitable[gpd.GeoDataFrame]], names_mapping : dict[str, str] | None = None, precision : int | None = None) -> TileResponse:
+    """
+    Get the cached tile or encode it from the layer, projected layer is cached too so neighbouring tiles are cut from it
+    """
+    tags = {(REGION_TAG, region_id)}
+
+    async def _load_projected_layer():
+        gdf = await load_layer()
+        return await compute.run(compute.TILES_KIND, _project_layer, gdf, names_mapping, precision)
+
+    async def _encode_tile():
+        gdf = await tiles_cache.get_or_set((layer_key, None), _load_projected_layer, LAYERS_CACHE_TTL, tags)
+        with metrics.stage('serialize'):
+            return await compute.run(compute.TILES_KIND, encode_tile, gdf, z, x, y, layer_name)
+
+    get_tile_bounds(z, x, y)
+    with metrics.endpoint(f'{layer_name}.tiles'):
+        tile = await tiles_cache.get_or_set((layer_key, (z, x, y)), _encode_tile, TILES_CACHE_TTL, tags)
+    return TileResponse(tile)
+
+def invalidate_tiles(region_id : int | None = None) -> int:
+    return invalidate_region(region_id, tiles_cache)
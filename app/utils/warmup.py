@@ -0,0 +1,95 @@
+import fcntl
+import json
+import os
+from datetime import datetime
+from typing import IO
+from .const import DATA_PATH, APP_VERSION
+
+WARMUP_PATH = os.path.join(DATA_PATH, 'warmup')
+
+def _get_lock_path(component : str) -> str:
+    return os.path.join(WARMUP_PATH, f'{component}.lock')
+
+def _get_state_path(component : str) -> str:
+    return os.path.join(WARMUP_PATH, f'{component}.json')
+
+def _get_completion_path(component : str) -> str:
+    return os.path.join(WARMUP_PATH, f'{component}.completed.json')
+
+def try_lock(component : str) -> IO | None:
+    """
+    Take the component warmup lock shared by all app workers, returns None if another worker holds it
+    """
+    os.makedirs(WARMUP_PATH, exist_ok=True)
+    lock_file = open(_get_lock_path(component), 'a+')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    # holder pid lets others check the lock without trying to take it
+    lock_file.truncate(0)
+    lock_file.write(str(os.getpid()))
+    lock_file.flush()
+    return lock_file
+
+def release(lock_file : IO):
+    lock_file.truncate(0)
+    lock_file.flush()
+    fcntl.flock(lock_file, fcntl.LOCK_UN)
+    lock_file.close()
+
+def is_locked(component : str) -> bool:
+    lock_path = _get_lock_path(component)
+    if not os.path.exists(lock_path):
+        return False
+    with open(lock_path) as f:
+        pid = f.read().strip()
+    if not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _read_state(component : str) -> dict[str, str]:
+    state_path = _get_state_path(component)
+    if not os.path.exists(state_path):
+        return {}
+    with open(state_path) as f:
+        return json.load(f)
+
+def mark_warm(region_id : int, component : str):
+    # written by the lock holder only, so no other writers to race with
+    state = _read_state(component)
+    state[str(region_id)] = datetime.now().isoformat()
+    tmp_path = f'{_get_state_path(component)}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, _get_state_path(component))
+
+def get_warm_regions(component : str) -> dict[int, str]:
+    """
+    Regions warmed up by the component with warmup times
+    """
+    return {int(region_id) : warmed_at for region_id, warmed_at in _read_state(component).items()}
+
+def mark_completed(component : str):
+    completion_path = _get_completion_path(component)
+    tmp_path = f'{completion_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'version': APP_VERSION, 'completed_at': datetime.now().isoformat()}, f)
+    os.replace(tmp_path, completion_path)
+
+def is_completed(component : str) -> bool:
+    """
+    Whether the component warmup was completed by the current app version
+    """
+    completion_path = _get_completion_path(component)
+    if not os.path.exists(completion_path):
+        return False
+    with open(completion_path) as f:
+        return json.load(f).get('version') == APP_VERSION
@@ -0,0 +1,7 @@
+import os
+import tempfile
+
+# app settings are read on import
+os.environ.setdefault('URBAN_API', 'http://urban-api')
+os.environ.setdefault('TRANSPORT_FRAMES_API', 'http://transport-frames-api')
+os.environ.setdefault('DATA_PATH', tempfile.mkdtemp())
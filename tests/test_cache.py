@@ -0,0 +1,32 @@
+import pytest
+from app.utils import cache
+
+@pytest.fixture(autouse=True)
+def invalidations_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, 'INVALIDATIONS_PATH', str(tmp_path / 'invalidations.json'))
+    monkeypatch.setattr(cache, '_seen_invalidations', {})
+
+def _as_worker(monkeypatch, seen_invalidations : dict):
+    # workers are separate processes, each with its own applied markers
+    monkeypatch.setattr(cache, '_seen_invalidations', seen_invalidations)
+
+def test_invalidations_reach_other_workers(monkeypatch):
+    first_worker, second_worker = {}, {}
+    _as_worker(monkeypatch, second_worker)
+    assert cache.pop_invalidations() == []
+
+    _as_worker(monkeypatch, first_worker)
+    cache.mark_invalidated(1)
+    cache.mark_invalidated(2)
+    # the invalidating worker has already cleared its own caches
+    assert cache.pop_invalidations() == []
+
+    _as_worker(monkeypatch, second_worker)
+    assert sorted(cache.pop_invalidations()) == [1, 2]
+    assert cache.pop_invalidations() == []
+
+    _as_worker(monkeypatch, first_worker)
+    cache.mark_invalidated(1)
+    cache.mark_invalidated()
+    _as_worker(monkeypatch, second_worker)
+    assert sorted(cache.pop_invalidations(), key=str) == [1, None]
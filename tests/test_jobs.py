@@ -0,0 +1,157 @@
+import asyncio
+import os
+import time
+import pytest
+from app.utils import jobs
+
+@pytest.fixture(autouse=True)
+def jobs_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, 'JOBS_DB_PATH', str(tmp_path / 'jobs.sqlite'))
+    monkeypatch.setattr(jobs, 'WAIT_INTERVAL', 0.01)
+    jobs._progress.clear()
+
+def test_coalescing():
+
+    async def run():
+        manager = jobs.JobManager(workers=1)
+        await manager.start()
+        release = asyncio.Event()
+        calls = []
+
+        async def func(value):
+            calls.append(value)
+            await release.wait()
+
+        first_id = await manager.submit('test', func, 1, region_id=1, options={'refresh': False})
+        # the same key submitted by another worker of the deployment
+        other_manager = jobs.JobManager(workers=1)
+        await other_manager.start()
+        same_id = await other_manager.submit('test', func, 2, region_id=1, options={'refresh': False})
+        await other_manager.stop()
+        other_region_id = await manager.submit('test', func, 3, region_id=2)
+        release.set()
+        await manager._queue.join()
+        await manager.stop()
+        return first_id, same_id, other_region_id, calls
+
+    first_id, same_id, other_region_id, calls = asyncio.run(run())
+    assert first_id == same_id != other_region_id
+    assert calls == [1, 3]
+    assert jobs.get_job(first_id)['options'] == {'refresh': False}
+    assert all(jobs.get_job(job_id)['status'] == jobs.JobStatus.SUCCEEDED.value for job_id in [first_id, other_region_id])
+
+def test_other_options_run_after():
+
+    async def run():
+        manager = jobs.JobManager(workers=2)
+        await manager.start()
+        release = asyncio.Event()
+        events = []
+
+        async def func(value):
+            events.append(('start', value))
+            await release.wait()
+            events.append(('end', value))
+
+        first_id = await manager.submit('test', func, 1, region_id=1, options={'refresh': False})
+        refresh_id = await manager.submit('test', func, 2, region_id=1, options={'refresh': True})
+        # coalesced into the queued follow-up, not run a third time
+        same_refresh_id = await manager.submit('test', func, 3, region_id=1, options={'refresh': True})
+        await asyncio.sleep(0.1)
+        running_events = list(events)
+        release.set()
+        refresh_job = await jobs.wait(refresh_id)
+        await manager.stop()
+        return first_id, refresh_id, same_refresh_id, running_events, events, refresh_job
+
+    first_id, refresh_id, same_refresh_id, running_events, events, refresh_job = asyncio.run(run())
+    assert first_id != refresh_id == same_refresh_id
+    # the second worker stays idle while the job of the same key runs
+    assert running_events == [('start', 1)]
+    assert events == [('start', 1), ('end', 1), ('start', 2), ('end', 2)]
+    assert refresh_job['status'] == jobs.JobStatus.SUCCEEDED.value
+
+def test_priority_order():
+
+    async def run():
+        manager = jobs.JobManager(workers=1)
+        await manager.start()
+        release = asyncio.Event()
+        order = []
+
+        async def block():
+            await release.wait()
+
+        async def func(name):
+            order.append(name)
+
+        # occupies the only worker while the rest are queued
+        await manager.submit('block', block)
+        await asyncio.sleep(0)
+        await manager.submit('test', func, 'region', region_id=1, priority=jobs.REGION_PRIORITY)
+        await manager.submit('test', func, 'project', region_id=2, priority=jobs.PROJECT_PRIORITY)
+        await manager.submit('test', func, 'region_later', region_id=3, priority=jobs.REGION_PRIORITY)
+        release.set()
+        await manager._queue.join()
+        await manager.stop()
+        return order
+
+    assert asyncio.run(run()) == ['project', 'region', 'region_later']
+
+def test_progress():
+
+    async def run():
+        manager = jobs.JobManager(workers=1)
+        await manager.start()
+        reported = asyncio.Event()
+        release = asyncio.Event()
+
+        async def func():
+            jobs.set_progress(0.5, 'half')
+            reported.set()
+            await release.wait()
+
+        job_id = await manager.submit('test', func)
+        await reported.wait()
+        running_job = jobs.get_job(job_id)
+        release.set()
+        await manager._queue.join()
+        await manager.stop()
+        return running_job, jobs.get_job(job_id)
+
+    running_job, finished_job = asyncio.run(run())
+    assert (running_job['progress'], running_job['message']) == (0.5, 'half')
+    assert finished_job['progress'] == 1
+
+@pytest.mark.parametrize('instance', [None, f'{os.getpid()}:0', '999999999:0'])
+def test_orphan_interruption(instance):
+    jobs._initialize_table()
+    # a row left by a stopped process, or by a process with the reused pid
+    with jobs._connect() as connection:
+        connection.execute(
+            'INSERT INTO jobs (id, kind, priority, status, instance, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+            ('orphan', 'test', jobs.REGION_PRIORITY, jobs.JobStatus.RUNNING.value, instance, time.time())
+        )
+
+    async def run():
+        manager = jobs.JobManager(workers=1)
+        await manager.start()
+        job_id = await manager.submit('test', asyncio.sleep, 0)
+        await manager._queue.join()
+        await manager.stop()
+        return job_id
+
+    job_id = asyncio.run(run())
+    assert job_id != 'orphan'
+    assert jobs.get_job('orphan')['status'] == jobs.JobStatus.INTERRUPTED.value
+
+def test_live_instance_is_kept():
+    jobs._initialize_table()
+    with jobs._connect() as connection:
+        connection.execute(
+            'INSERT INTO jobs (id, kind, priority, status, instance, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+            ('alive', 'test', jobs.REGION_PRIORITY, jobs.JobStatus.QUEUED.value, jobs.get_instance_id(), time.time())
+        )
+    with jobs._connect() as connection:
+        jobs._interrupt_orphans(connection)
+    assert jobs.get_job('alive')['status'] == jobs.JobStatus.QUEUED.value
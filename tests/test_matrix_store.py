@@ -0,0 +1,39 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from app.utils import matrix_store
+
+@pytest.fixture(autouse=True)
+def matrices_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(matrix_store, 'MATRICES_PATH', str(tmp_path))
+    return tmp_path
+
+def _get_matrix(value : float) -> pd.DataFrame:
+    return pd.DataFrame(np.full((2, 2), value), index=[1, 2], columns=[1, 2])
+
+def test_save_replaces_version(matrices_path):
+    matrix_store.save(_get_matrix(1), 1, 'drive', fingerprint='a')
+    # the loaded matrix keeps its files after being replaced
+    old_mx = matrix_store.load(1, 'drive')
+    matrix_store.save(_get_matrix(2), 1, 'drive', fingerprint='b')
+    assert old_mx.values.sum() == 4
+    assert matrix_store.load(1, 'drive').values.sum() == 8
+    assert matrix_store.exists(1, 'drive', fingerprint='b')
+    assert len(os.listdir(matrices_path)) == 2
+
+def test_save_replaces_legacy_directory(matrices_path):
+    legacy_path = matrix_store._get_dir_path(1, 'drive')
+    os.makedirs(legacy_path)
+    np.save(os.path.join(legacy_path, matrix_store.VALUES_FILE), np.zeros((2, 2)))
+    matrix_store.save(_get_matrix(1), 1, 'drive')
+    assert os.path.islink(legacy_path)
+    assert matrix_store.load(1, 'drive').values.sum() == 4
+    assert len(os.listdir(matrices_path)) == 2
+
+def test_delete(matrices_path):
+    matrix_store.save(_get_matrix(1), 1, 'drive')
+    assert matrix_store.delete(1, 'drive')
+    assert not matrix_store.exists(1, 'drive')
+    assert not matrix_store.delete(1, 'drive')
+    assert os.listdir(matrices_path) == []
@@ -0,0 +1,64 @@
+import asyncio
+import geopandas as gpd
+import pytest
+from shapely.geometry import Point
+from app.utils import objects_store
+
+@pytest.fixture(autouse=True)
+def objects_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(objects_store, 'OBJECTS_PATH', str(tmp_path))
+
+def _get_gdf(names : list[str] | None = None) -> gpd.GeoDataFrame:
+    names = names or ['a', 'b', 'c']
+    return gpd.GeoDataFrame({
+        'name': names,
+        'object_type': [{'id': i, 'name': name} for i, name in enumerate(names)],
+        'territories': [[{'id': i}] for i in range(len(names))],
+        'geometry': [Point(i, i) for i in range(len(names))],
+    }, index=range(1, len(names) + 1), crs=4326)
+
+def test_encode_decode():
+    gdf = _get_gdf()
+    df, json_columns = objects_store._encode(gdf)
+    assert json_columns == ['object_type', 'territories']
+    assert df['object_type'].map(type).eq(str).all()
+    # the source frame is left as is
+    assert gdf.loc[1, 'object_type'] == {'id': 0, 'name': 'a'}
+    decoded_gdf = objects_store._decode(df, json_columns)
+    assert decoded_gdf.equals(gdf)
+
+def test_save_load():
+    gdf = _get_gdf()
+    objects_store.save(gdf, 1, 2)
+    assert objects_store.exists(1, 2)
+    loaded_gdf = objects_store.load(1, 2)
+    assert loaded_gdf.to_dict() == gdf.to_dict()
+    objects_store.save(None, 1, 2)
+    assert objects_store.exists(1, 2) and objects_store.load(1, 2) is None
+
+def test_diff():
+    old_gdf = _get_gdf()
+    new_gdf = _get_gdf().drop(index=1)
+    new_gdf.loc[4] = ['d', {'id': 3, 'name': 'd'}, [{'id': 3}], Point(3, 3)]
+    new_gdf.at[2, 'object_type'] = {'id': 1, 'name': 'renamed'}
+    new_gdf.loc[3, 'geometry'] = Point(10, 10)
+    assert objects_store._diff(old_gdf, new_gdf) == {'added': 1, 'removed': 1, 'changed': 2}
+    assert objects_store._diff(old_gdf, _get_gdf()) == {'added': 0, 'removed': 0, 'changed': 0}
+    assert objects_store._diff(None, old_gdf) == {'added': 3, 'removed': 0, 'changed': 0}
+    assert objects_store._diff(old_gdf, None) == {'added': 0, 'removed': 3, 'changed': 0}
+
+def test_get_version(monkeypatch):
+    synced = []
+
+    async def sync(region_id, pot_id):
+        synced.append(pot_id)
+        objects_store.save(_get_gdf(), region_id, pot_id)
+        return True
+
+    monkeypatch.setattr(objects_store, 'sync', sync)
+    objects_store.save(_get_gdf(), 1, 2)
+    version = asyncio.run(objects_store.get_version(1, [2, 3, 3]))
+    assert synced == [3] and None not in version
+    assert asyncio.run(objects_store.get_version(1, [2, 3])) == version
+    objects_store.save(_get_gdf(['e']), 1, 3)
+    assert asyncio.run(objects_store.get_version(1, [2, 3])) != version
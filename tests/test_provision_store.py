@@ -0,0 +1,50 @@
+from concurrent.futures import ThreadPoolExecutor
+import geopandas as gpd
+import numpy as np
+import pytest
+from shapely.geometry import Point
+from app.routers.provision import provision_store
+
+@pytest.fixture(autouse=True)
+def provisions_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(provision_store, 'PROVISIONS_PATH', str(tmp_path))
+    provision_store.frames_cache.invalidate()
+
+def _get_provision(service_type_id : int, count : int = 20) -> gpd.GeoDataFrame:
+    rng = np.random.default_rng(service_type_id)
+    # every service type covers its own towns, so the shared geometry is merged by the writers
+    index = range(service_type_id, service_type_id + count)
+    return gpd.GeoDataFrame({'provision': rng.random(count)}, geometry=[Point(i, i) for i in index], index=index, crs=4326)
+
+def test_concurrent_saves():
+    service_types_ids = list(range(10))
+    with ThreadPoolExecutor(4) as executor:
+        list(executor.map(lambda st_id : provision_store.save(_get_provision(st_id), 1, st_id), service_types_ids))
+    assert sorted(provision_store.get_service_types_ids(1)) == service_types_ids
+    with ThreadPoolExecutor(4) as executor:
+        provisions_list = list(executor.map(lambda _ : provision_store.load_many(1, service_types_ids), range(4)))
+    for provisions in provisions_list:
+        for st_id in service_types_ids:
+            expected_gdf = _get_provision(st_id)
+            assert np.allclose(provisions[st_id]['provision'], expected_gdf['provision'])
+            assert provisions[st_id].geometry.geom_equals(expected_gdf.geometry).all()
+
+def test_rewritten_partition_is_reread():
+    provision_store.save(_get_provision(1), 1, 1)
+    provision_store.load(1, 1)
+    provision_gdf = _get_provision(1)
+    provision_gdf['provision'] = 0.5
+    provision_store.save(provision_gdf, 1, 1)
+    assert (provision_store.load(1, 1)['provision'] == 0.5).all()
+
+def test_version():
+    assert provision_store.get_version(1) == (0, 0)
+    provision_store.save(_get_provision(1), 1, 1)
+    version = provision_store.get_version(1, layer='all')
+    assert version[0] == 1
+    provision_store.save(_get_provision(2), 1, 2)
+    assert provision_store.get_version(1, layer='all') != version
+    # aggregations by units do not change town level provisions
+    version = provision_store.get_version(1, layer='all')
+    provision_store.save(_get_provision(1), 1, 1, level=2)
+    assert provision_store.get_version(1, layer='all') == version
@@ -0,0 +1,69 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+from townsnet.provision.service_type import ServiceType, AccessibilityType, SupplyType, Category
+from townsnet.provision.social_model import SocialModel
+from app.routers.provision import provision_service
+
+CELLS_COUNT = 96
+
+@pytest.fixture(scope='module')
+def social_model() -> SocialModel:
+    rng = np.random.default_rng(0)
+    towns_count = 60
+    # towns scattered around the city by ~30 km, so every radius leaves some cells without towns
+    towns_gdf = gpd.GeoDataFrame(
+        {'name': [f'town {i}' for i in range(towns_count)]},
+        geometry=gpd.points_from_xy(30.3 + rng.uniform(-0.3, 0.3, towns_count), 59.9 + rng.uniform(-0.15, 0.15, towns_count)),
+        index=range(1, towns_count + 1),
+        crs=4326
+    )
+    service_types_params = [
+        (1, AccessibilityType.METERS, 1000, Category.BASIC, 1),
+        (2, AccessibilityType.MINUTES, 5, Category.BASIC, 0.5),
+        (3, AccessibilityType.METERS, 5000, Category.ADDITIONAL, 0.7),
+        (4, AccessibilityType.MINUTES, 15, Category.ADDITIONAL, 0.2),
+        (5, AccessibilityType.METERS, 15000, Category.COMFORT, 0.9),
+        (6, AccessibilityType.MINUTES, 10, Category.COMFORT, 0.4),
+    ]
+    provisions = {}
+    for st_id, accessibility_type, accessibility_value, category, weight in service_types_params:
+        service_type = ServiceType(
+            id=st_id, name=f'service type {st_id}',
+            accessibility_type=accessibility_type, accessibility_value=accessibility_value,
+            supply_type=SupplyType.SERVICES_PER_1000, supply_value=1,
+            category=category, weight=weight
+        )
+        demand = rng.integers(1, 100, towns_count)
+        provisions[service_type] = pd.DataFrame({
+            'demand': demand,
+            'demand_within': (demand * rng.uniform(0, 1, towns_count)).astype(int)
+        }, index=towns_gdf.index)
+    return SocialModel(towns_gdf, provisions)
+
+@pytest.fixture(scope='module')
+def cells_gdf() -> gpd.GeoDataFrame:
+    # grid of ~1.5 km cells spanning beyond the towns
+    xs, ys = np.meshgrid(np.linspace(29.3, 31.3, 12), np.linspace(59.5, 60.3, 8))
+    cells = [shapely.box(x, y, x + 0.025, y + 0.0135) for x, y in zip(xs.ravel(), ys.ravel())]
+    return gpd.GeoDataFrame(geometry=cells, index=range(100, 100 + CELLS_COUNT), crs=4326)
+
+def test_batch_matches_per_cell(social_model, cells_gdf):
+    batch_df = provision_service.evaluate_social_batch(social_model, cells_gdf.geometry, interpretation=True)
+    assert len(batch_df) == CELLS_COUNT
+    assert batch_df.index.equals(cells_gdf.index)
+    for cell_id, geometry in cells_gdf.geometry.items():
+        score, categories_scores, interpretation = provision_service.evaluate_social(social_model, geometry)
+        cell = batch_df.loc[cell_id]
+        assert cell['score'] == pytest.approx(score, abs=1e-9, nan_ok=True)
+        for category, category_score in categories_scores.items():
+            assert cell[category] == pytest.approx(category_score, abs=1e-9, nan_ok=True)
+        assert cell['interpretation'] == interpretation
+
+def test_batch_covers_cells_without_towns(social_model, cells_gdf):
+    batch_df = provision_service.evaluate_social_batch(social_model, cells_gdf.geometry)
+    assert 'interpretation' not in batch_df.columns
+    # the synthetic grid should exercise both empty and populated neighbourhoods
+    assert (batch_df['score'] == 0).any() and (batch_df['score'] > 0).any()
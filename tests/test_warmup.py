@@ -0,0 +1,20 @@
+import pytest
+from app.utils import warmup
+
+@pytest.fixture(autouse=True)
+def warmup_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(warmup, 'WARMUP_PATH', str(tmp_path))
+
+def test_completion_is_kept_for_version(monkeypatch):
+    assert not warmup.is_completed('test')
+    warmup.mark_completed('test')
+    assert warmup.is_completed('test')
+    monkeypatch.setattr(warmup, 'APP_VERSION', 'next')
+    assert not warmup.is_completed('test')
+
+def test_lock():
+    lock_file = warmup.try_lock('test')
+    assert lock_file is not None and warmup.is_locked('test')
+    assert warmup.try_lock('test') is None
+    warmup.release(lock_file)
+    assert not warmup.is_locked('test')